@@ -0,0 +1,133 @@
+import os
+import sys
+import time
+import logging
+import tempfile
+
+# Benchmarks always run against the simulated panel, and keep their state out of the real state directory
+os.environ["EPD_BACKEND"] = "simulated"
+os.environ["STATE_DIR"] = tempfile.mkdtemp()
+os.environ.setdefault("LATITUDE", "51.5")
+os.environ.setdefault("LONGITUDE", "-0.13")
+
+from waveshare_epd import epd2in13b_V4, epdconfig
+from reading.Reading import Reading
+from reading.ReadingBatch import ReadingBatch
+from display.Display import Display
+from history.History import History
+
+logging.basicConfig(
+    format='%(asctime)s %(levelname)-8s %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S'
+    )
+logger = logging.getLogger(__name__)
+
+# Reading used by the rendering benchmarks
+SAMPLE_DATA = [{
+    "timestamp": "2024-05-01T12:00:00Z",
+    "readings": {
+        "temperature": 21.5,
+        "pressure": 1013,
+        "humidity": 55,
+        "luminance": 5000,
+        "rain": 0,
+        "wind_speed": "3.14",
+        "wind_direction": 90,
+    },
+}]
+
+def bench_command_sequence(iterations):
+    """Compare sending the init registers a byte at a time against `EPD.send_sequence`
+
+    Args
+    -----
+    iterations: `int`
+        Number of times to send the init sequence with each method
+    """
+    epd = epd2in13b_V4.EPD()
+    sim = epdconfig.get_implementation()
+
+    def per_byte():
+        for command, data in epd2in13b_V4.INIT_SEQUENCE:
+            epd.send_command(command)
+            for byte in data:
+                epd.send_data(byte)
+
+    def batched():
+        epd.send_sequence(epd2in13b_V4.INIT_SEQUENCE)
+
+    for name, send in (("per byte", per_byte), ("batched", batched)):
+        sim.clear_log()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            send()
+        elapsed = time.perf_counter() - start
+        logger.info(f"{name}: {sim.gpio_writes // iterations} GPIO writes, {sim.spi_calls // iterations} SPI transfers, {elapsed * 1e6 / iterations:.1f} us per init sequence")
+
+def bench_glyph_cache(iterations):
+    """Compare rendering a full frame with cached glyphs against rasterising text with FreeType
+
+    Args
+    -----
+    iterations: `int`
+        Number of frames to render in each mode
+    """
+    display = Display(Reading(SAMPLE_DATA))
+    logging.getLogger("display.Display").setLevel(logging.WARNING)
+
+    for name, use_glyph_cache in (("FreeType", False), ("glyph cache", True)):
+        display.use_glyph_cache = use_glyph_cache
+        # warm up the static layer and glyphs so only steady state rendering is timed
+        display.render()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            display.render()
+        elapsed = time.perf_counter() - start
+        logger.info(f"{name}: {elapsed * 1000 / iterations:.2f} ms per frame")
+
+def bench_graph(iterations):
+    """Render full graph pages from two days of history and fail if they're over budget
+
+    The measured time is scaled by `BENCH_CPU_FACTOR` (default 10, roughly a Pi Zero against
+    a desktop core) and compared to `BENCH_GRAPH_BUDGET_MS` (default 100)
+
+    Args
+    -----
+    iterations: `int`
+        Number of frames to render
+    """
+    os.environ["DISPLAY_MODE"] = "graph"
+    reading = Reading(SAMPLE_DATA)
+    history = History("bench_history.bin", 1000)
+    for i in range(576, 0, -1):
+        timestamp = reading.timestamp - i * 300
+        history.append((timestamp, 15 + (i % 40) / 4, 1000 + i % 25, 50 + i % 30, (i * 37) % 5000, i % 3, (i % 17) / 2, 90))
+    reading.get_changes_and_save(history, ReadingBatch(SAMPLE_DATA))
+    display = Display(reading, history)
+    logging.getLogger("display.Display").setLevel(logging.WARNING)
+
+    display.render()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        display.render()
+    elapsed_ms = (time.perf_counter() - start) * 1000 / iterations
+
+    cpu_factor = float(os.environ.get("BENCH_CPU_FACTOR", 10))
+    budget_ms = float(os.environ.get("BENCH_GRAPH_BUDGET_MS", 100))
+    logger.info(f"graph page: {elapsed_ms:.2f} ms per frame, {elapsed_ms * cpu_factor:.1f} ms scaled by {cpu_factor:g}, budget {budget_ms:g} ms")
+    if elapsed_ms * cpu_factor > budget_ms:
+        logger.error("Graph page is over budget")
+        sys.exit(1)
+
+benchmarks = {
+    "epd": bench_command_sequence,
+    "glyphs": bench_glyph_cache,
+    "graph": bench_graph,
+}
+
+if len(sys.argv) < 2 or sys.argv[1] not in benchmarks:
+    print(f"Usage: python bench.py [{'|'.join(benchmarks)}] [iterations]")
+    sys.exit(1)
+
+benchmarks[sys.argv[1]](int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
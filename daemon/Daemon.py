@@ -0,0 +1,137 @@
+import os
+import time
+import signal
+import logging
+import threading
+
+from reading.Reading import Reading
+from reading.ReadingBatch import ReadingBatch
+from display.Display import Display
+from fetch.Fetcher import Fetcher
+from history.History import History
+from state.State import State
+from daemon.Scheduler import Scheduler
+from daemon.PanelWorker import PanelWorker
+
+logger = logging.getLogger(__name__)
+
+class Daemon:
+    """Keep a single display and its loaded assets alive between updates"""
+    def __init__(self, api_url, interval, lock = None):
+        # coalesce state writes to spare the SD card, they're flushed on shutdown
+        State.flush_interval = float(os.environ.get("STATE_FLUSH_INTERVAL", 900))
+        self.fetcher = Fetcher(api_url, Reading)
+        self.interval = interval
+        self.history = History()
+        self.display = Display(history = self.history)
+        self.scheduler = Scheduler(self.history, interval)
+        self.panel = PanelWorker(self.display)
+        self.stop_event = threading.Event()
+        # set to cut a wait short, on shutdown, when a clear is requested or when an overlapping run hands over
+        self.wake_event = threading.Event()
+        self.clear_requested = False
+        # instance lock, for requests handed over by runs started while the daemon holds it
+        self.lock = lock
+
+    def handle_signal(self, signum, frame):
+        """Stop the update loop after the current cycle"""
+        logger.info(f"Received signal {signum}, shutting down")
+        self.stop_event.set()
+        self.wake_event.set()
+
+    def handle_clear_signal(self, signum, frame):
+        """Clear the display straight away"""
+        logger.info("Clear requested, display will be cleared on next update")
+        self.clear_requested = True
+        self.wake_event.set()
+
+    def handle_request_signal(self, signum, frame):
+        """Serve requests handed over by overlapping runs straight away"""
+        logger.info("Woken by an overlapping run, updating now")
+        self.wake_event.set()
+
+    def update(self):
+        """Fetch, compare and render a single reading, and hand the frame to the panel worker
+        
+        Returns
+        -----
+        `bool`
+            True if a frame was handed over
+        """
+        # Overlapping runs are served by this cycle, only a clear changes what it does
+        if self.lock is not None and "clear" in self.lock.take_requests():
+            self.clear_requested = True
+
+        # A clear needs a reading to redraw even if the API has nothing new
+        result = self.fetcher.wait_for_refresh(not self.clear_requested)
+        data, version = self.fetcher.cache.get_entry()
+        if data is None:
+            logger.error("No reading available from the API or cache")
+            return False
+
+        stale = self.fetcher.cache.is_stale()
+        if not self.clear_requested and result == "not_modified" and self.fetcher.cache.is_displayed(stale):
+            return False
+
+        reading = Reading(data)
+        reading.get_changes_and_save(self.history, ReadingBatch(data))
+        self.display.set_reading(reading, stale)
+        black, red = self.display.render()
+
+        # The refresh runs on the panel thread while the next cycle carries on, unchanged frames are skipped there
+        force_clear, self.clear_requested = self.clear_requested, False
+        timestamp = self.history.last()[0]
+        self.panel.submit(black, red, force_clear, lambda: self.on_shown(stale, version, timestamp))
+        return True
+
+    def on_shown(self, stale, version, timestamp):
+        """Record a frame reaching the display, called from the panel thread
+
+        Args
+        -----
+        stale: `bool`
+            Whether the reading was shown as stale
+        version: `int`
+            Version of the cached response the frame was drawn from
+        timestamp: `int`
+            Timestamp of the newest reading in the frame
+        """
+        self.fetcher.cache.mark_displayed(stale, version)
+        self.scheduler.record_shown(timestamp, time.time())
+
+    def run(self):
+        """Run the update loop until SIGTERM or SIGINT is received, SIGUSR1 requests a clear and SIGUSR2 an update"""
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGINT, self.handle_signal)
+        signal.signal(signal.SIGUSR1, self.handle_clear_signal)
+        signal.signal(signal.SIGUSR2, self.handle_request_signal)
+        # only advertise as a daemon once SIGUSR2 is handled, until then it would kill the process
+        if self.lock is not None:
+            self.lock.set_role("daemon")
+        logger.info(f"Starting daemon, updating every {self.interval}s until the upload interval is learnt")
+
+        try:
+            while not self.stop_event.is_set():
+                last = self.history.last()
+                try:
+                    self.update()
+                except Exception:
+                    # Keep running through API outages and bad payloads
+                    logger.exception("Update failed")
+                try:
+                    delay = self.scheduler.plan(None if last is None else last[0], time.time())
+                except Exception:
+                    # a scheduling fault shouldn't stop the display, fall back to the fixed interval
+                    logger.exception("Scheduling failed")
+                    delay = self.interval
+                # keep the panel awake, asleep with RAM intact, or off, depending on how long until it's next needed
+                self.panel.rest(delay)
+                # write out anything held back for longer than the flush interval
+                State.flush_all(False)
+                self.wake_event.wait(delay)
+                self.wake_event.clear()
+        finally:
+            logger.info("Cleaning up display")
+            self.panel.stop()
+            self.display.cleanup()
+            State.flush_all()
@@ -0,0 +1,92 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class PanelWorker:
+    """Drives the panel on its own thread so fetching and rendering carry on through a refresh
+
+    Holds at most one frame waiting to be shown. A newer frame replaces one that hasn't
+    been started yet, so the panel always shows the newest and never works through a backlog
+    """
+    def __init__(self, display):
+        self.display = display
+        self.condition = threading.Condition()
+        # newest frame waiting to be shown, as (black, red, force_clear, on_shown)
+        self.frame = None
+        # expected seconds until the next frame, waiting to be passed to `Display.rest`
+        self.idle = None
+        self.rest_requested = False
+        self.stopping = False
+        self.dropped = 0
+        self.thread = threading.Thread(target = self.run, name = "panel", daemon = True)
+        self.thread.start()
+
+    def submit(self, black, red, force_clear = False, on_shown = None):
+        """Queue a rendered frame to be shown, replacing any frame not started yet
+
+        Args
+        -----
+        black: `bytes`
+            Black buffer from `Display.render`
+        red: `bytes`
+            Red buffer from `Display.render`
+        force_clear: `bool`
+            If true, clear the display and refresh even if the frame hasn't changed
+        on_shown: `callable`
+            Called once the frame has been shown, or skipped as unchanged
+        """
+        with self.condition:
+            if self.frame is not None:
+                self.dropped += 1
+                logger.info(f"Dropping frame superseded before it was shown ({self.dropped} dropped)")
+                # a requested clear still happens with the newer frame
+                force_clear = force_clear or self.frame[2]
+            self.frame = (black, red, force_clear, on_shown)
+            self.condition.notify()
+
+    def rest(self, idle):
+        """Rest the panel once any waiting frame has been shown
+
+        Args
+        -----
+        idle: `float`
+            Expected seconds until the next frame
+        """
+        with self.condition:
+            self.idle = idle
+            self.rest_requested = True
+            self.condition.notify()
+
+    def run(self):
+        """Show frames and rest the panel as they're requested, until stopped"""
+        while True:
+            with self.condition:
+                while self.frame is None and not self.rest_requested and not self.stopping:
+                    self.condition.wait()
+                if self.stopping:
+                    return
+                frame, self.frame = self.frame, None
+                # frames go first, resting between them would only mean waking straight back up
+                rest = frame is None and self.rest_requested
+                if rest:
+                    self.rest_requested = False
+
+            try:
+                if frame is not None:
+                    black, red, force_clear, on_shown = frame
+                    self.display.show(black, red, force_clear)
+                    if on_shown is not None:
+                        on_shown()
+                elif rest:
+                    self.display.rest(self.idle)
+            except Exception:
+                # keep the worker alive through panel errors, the next frame tries again
+                logger.exception("Panel update failed")
+
+    def stop(self):
+        """Stop after the frame or rest in progress, dropping any still waiting"""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.thread.join()
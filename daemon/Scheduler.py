@@ -0,0 +1,112 @@
+import os
+import math
+import logging
+import statistics
+from state.State import State
+
+logger = logging.getLogger(__name__)
+
+# number of recent readings the upload interval is learnt from
+SAMPLE_SIZE = 12
+
+class Scheduler:
+    """Plans when the daemon next fetches, from the cadence of readings in history
+
+    The upload interval is the median gap between recent readings, and the phase comes
+    from the newest reading, so the next fetch lands `SCHEDULE_MARGIN` seconds after the
+    next expected upload. While fetches turn up nothing new, retries back off from
+    `SCHEDULE_RETRY` seconds up to `SCHEDULE_MAX_DELAY`, and snap back to the cadence
+    as soon as a new reading arrives
+    """
+    def __init__(self, history, fallback):
+        self.history = history
+        self.fallback = fallback
+        self.margin = float(os.environ.get("SCHEDULE_MARGIN", 30))
+        self.retry = float(os.environ.get("SCHEDULE_RETRY", 30))
+        self.max_delay = float(os.environ.get("SCHEDULE_MAX_DELAY", 900))
+        self.misses = 0
+        # wakeups, wasted fetches and latency are kept across restarts for tuning
+        self.state = State("scheduler_state.json")
+
+    def get_interval(self):
+        """Returns the learnt upload interval
+
+        Returns
+        -----
+        `float`
+            seconds between uploads, or None if there aren't enough readings yet
+        """
+        first = max(self.history.count - SAMPLE_SIZE, 0)
+        timestamps = [self.history.read(i)[0] for i in range(first, self.history.count)]
+        gaps = [b - a for a, b in zip(timestamps, timestamps[1:]) if b > a]
+        return statistics.median(gaps) if gaps else None
+
+    def record_shown(self, timestamp, now):
+        """Record the time from a reading being taken to it being on the display, once per reading
+
+        Called from the panel thread once the frame is shown
+
+        Args
+        -----
+        timestamp: `int`
+            Timestamp of the newest reading in the frame
+        now: `float`
+            Unix time the frame was shown
+        """
+        # redraws of a reading already shown, e.g. for staleness or a clear, aren't new readings
+        if timestamp <= self.state.get("last_shown", 0):
+            return
+        latency = now - timestamp
+        self.state.set("last_shown", timestamp)
+        self.state.set("new_readings", self.state.get("new_readings", 0) + 1)
+        self.state.set("total_latency", self.state.get("total_latency", 0) + latency)
+        logger.info(f"New reading displayed {latency:.0f}s after it was taken")
+        self.state.save()
+
+    def plan(self, previous, now):
+        """Record the outcome of a fetch and return how long to wait before the next
+
+        Args
+        -----
+        previous: `int`
+            Timestamp of the newest reading before the fetch, None if there wasn't one
+        now: `float`
+            Unix time the fetch finished
+
+        Returns
+        -----
+        `float`
+            seconds to wait
+        """
+        last = self.history.last()
+        interval = self.get_interval()
+        # when the reading after the newest should have been uploaded
+        due = None if interval is None else last[0] + interval + self.margin
+        wakeups = self.state.get("wakeups", 0) + 1
+        self.state.set("wakeups", wakeups)
+        if last is not None and (previous is None or last[0] > previous):
+            self.misses = 0
+        else:
+            self.state.set("wasted", self.state.get("wasted", 0) + 1)
+            # stop counting once the backoff has reached its cap
+            if due is not None and now >= due and self.retry * 2 ** (self.misses - 1) < self.max_delay:
+                self.misses += 1
+
+        if interval is None:
+            delay = self.fallback
+        elif now < due:
+            delay = due - now
+        elif self.misses:
+            # late or quiet, back off until something turns up
+            delay = self.retry * 2 ** min(self.misses - 1, 16)
+        else:
+            # already past due when it arrived, so aim for the next upload in phase with it
+            delay = last[0] + math.ceil((now - last[0]) / interval) * interval + self.margin - now
+        delay = min(max(delay, 1), self.max_delay)
+
+        new_readings = self.state.get("new_readings", 0)
+        mean_latency = self.state.get("total_latency", 0) / new_readings if new_readings else 0
+        logger.info(f"Next fetch in {delay:.0f}s (interval {interval or self.fallback:.0f}s, misses {self.misses}), "
+                    f"wakeups {wakeups}, wasted fetches {self.state.get('wasted', 0)}, mean latency {mean_latency:.0f}s")
+        self.state.save()
+        return delay
@@ -1,28 +1,143 @@
 import os
+import time
+import hashlib
 import logging
+import threading
 import pytz
-from PIL import Image, ImageDraw, ImageFont
-from astral import LocationInfo
-from astral.sun import sun
+from PIL import Image, ImageDraw
 from datetime import datetime
 from waveshare_epd import epd2in13b_V4
+from state.State import State, state_path, write_atomic
+from display.IconAtlas import IconAtlas
+from display.GlyphCache import GlyphCache, font_dir
+from display.SunTimes import SunTimes
+from display.PowerManager import PowerManager
 
 logger = logging.getLogger(__name__)
 
-font_dir = os.path.join(os.path.dirname(os.path.relpath(__file__)), "../font")
+# How far the canvas is turned on the panel, mapped to the single transpose that takes it
+# straight to the panel's native 122x250 RAM layout. Only landscape, the layout below doesn't fit portrait
+ORIENTATIONS = {
+    0: Image.ROTATE_90,
+    180: Image.ROTATE_270,
+}
+
+# Dashboard layout. Header, dividers and labels never change so they're drawn once into a cached static layer
+HEADER = ((2, 2), 'Weathervane')
+TIME_POSITION = (138, 9)
+STALE_POSITION = (128, 5)
+DIVIDERS = ((0, 26, 250, 26), (124, 26, 124, 122))
+LINE_SPACING = 24
+START_Y = 30
+IND_START_Y = 36
+ICON_POSITION = (224, 96)
+COLUMNS = (
+    {
+        "label_x": 2,
+        "value_x": 18,
+        "indicator_x": 114,
+        "rows": (
+            ("temperature", "T:", "{} °C"),
+            ("pressure", "P:", "{} hPA"),
+            ("humidity", "H:", "{} %"),
+            ("luminance", "L:", "{} Lx"),
+        ),
+    },
+    {
+        "label_x": 129,
+        "value_x": 148,
+        "indicator_x": 240,
+        "rows": (
+            ("rain", "R:", "{} mm"),
+            ("wind_speed", "W:", "{} m/s"),
+            ("wind_direction", "D:", "{}"),
+        ),
+    },
+)
 
 class Display:
     """Creation and display of reading image"""
-    def __init__(self, reading):
-        self.epd = epd2in13b_V4.EPD()
-        self.font_header = ImageFont.truetype(os.path.join(font_dir, 'Roboto-Regular.ttf'), 20)
-        self.font_body = ImageFont.truetype(os.path.join(font_dir, 'Roboto-Thin.ttf'), 16)
-        self.font_caption = ImageFont.truetype(os.path.join(font_dir, 'Roboto-Thin.ttf'), 12)
-        self.BlackImage = Image.new('1', (self.epd.height, self.epd.width), 255)
-        self.RedImage = Image.new('1', (self.epd.height, self.epd.width), 255)
+    # Shared by every Display so icons and the static layer are only loaded once per process
+    icon_atlas = IconAtlas()
+    static_layers = {}
+
+    def __init__(self, reading = None, history = None):
+        self._epd = None
+        self._power = None
+        # held for every use of the panel so SPI and GPIO access never overlaps between threads
+        self.panel_lock = threading.RLock()
+        # `values` shows the latest readings, `graph` shows sparklines of their history
+        self.mode = os.environ.get("DISPLAY_MODE", "values")
+        if self.mode not in ("values", "graph"):
+            raise ValueError("DISPLAY_MODE must be values or graph")
+        self.graph = None
+        if self.mode == "graph":
+            if history is None:
+                raise ValueError("Graph mode needs reading history")
+            # Only graph mode pays for importing NumPy
+            from display.Graph import Graph
+            self.graph = Graph(history, float(os.environ.get("GRAPH_HOURS", 24)))
+        # Checked here so missing coordinates fail before anything is drawn
+        self.sun_times = SunTimes.from_env()
+        # Defaults to 180 to compensate for display orientation in the case I'm using
+        self.orientation = int(os.environ.get("DISPLAY_ORIENTATION", 180))
+        if self.orientation not in ORIENTATIONS:
+            raise ValueError(f"DISPLAY_ORIENTATION must be one of {', '.join(str(o) for o in ORIENTATIONS)}")
+        self.canvas_size = (epd2in13b_V4.EPD_HEIGHT, epd2in13b_V4.EPD_WIDTH)
+        # Fonts as (file, size), only loaded by the glyph cache when a glyph isn't cached yet
+        self.font_header = ('Roboto-Regular.ttf', 20)
+        self.font_body = ('Roboto-Thin.ttf', 16)
+        self.font_caption = ('Roboto-Thin.ttf', 12)
+        self.glyph_cache = GlyphCache()
+        self.use_glyph_cache = os.environ.get("GLYPH_CACHE", "1") == "1"
+        self.new_canvas()
+        self.reading = reading
+        self.stale = False
+        self.state = State("display_state.json")
+
+    @property
+    def epd(self):
+        """E-ink display driver, created on first use so runs that never touch the display skip hardware setup"""
+        if self._epd is None:
+            self._epd = epd2in13b_V4.EPD()
+        return self._epd
+
+    @property
+    def power(self):
+        """Power state manager for the e-ink display, created when the panel is first woken"""
+        if self._power is None:
+            self._power = PowerManager(self.epd)
+        return self._power
+
+    def new_canvas(self, base = None):
+        """Replace the black and red images with blank ones, or copies of a base layer
+        
+        Args
+        -----
+        base: `tuple(Image)`
+            Optional black and red images to start from
+        """
+        if base is None:
+            self.BlackImage = Image.new('1', self.canvas_size, 255)
+            self.RedImage = Image.new('1', self.canvas_size, 255)
+        else:
+            self.BlackImage = base[0].copy()
+            self.RedImage = base[1].copy()
         self.draw_black = ImageDraw.Draw(self.BlackImage)
         self.draw_red = ImageDraw.Draw(self.RedImage)
+
+    def set_reading(self, reading, stale = False):
+        """Set the reading to be drawn on the next update
+        
+        Args
+        -----
+        reading: `Reading`
+            Reading to display
+        stale: `bool`
+            If true, mark the reading as out of date
+        """
         self.reading = reading
+        self.stale = stale
 
     def get_polygon_coords(self, start, type):
         """Return coordinates for change indicator polygons
@@ -62,123 +177,387 @@ class Display:
         Returns
         -----
         `Image`
-            Image object of weather icon bmp
-        """
-        sunrise, sunset = self.get_sunrise_sunset_times().values()
-
-        if self.reading.rain > 0:
-            return Image.open('./display/icons/rain.bmp')
-        elif self.reading.wind_speed > 8:
-            return Image.open('./display/icons/wind.bmp')
-        elif self.reading.luminance >= 3000:
-            return Image.open('./display/icons/sun.bmp')
-        elif self.reading.luminance < 3000 and self.reading.luminance >= 800:
-            return Image.open('./display/icons/cloudy.bmp')
-        elif self.reading.luminance < 800:
-            if sunrise < datetime.now(pytz.timezone("Europe/London")) < sunset:
-                return Image.open('./display/icons/cloud.bmp')
-            else:
-                return Image.open('./display/icons/moon.bmp')
+            1-bit image of weather icon from the shared icon atlas
+        """
+        return self.icon_atlas.choose(self.get_condition)
+
+    def get_condition(self, name):
+        """Returns the value of a condition used by the icon rules
+
+        Args
+        -----
+        name: `str`
+            `daylight`, or the name of a reading value e.g. `rain`
 
-    def get_sunrise_sunset_times(self):
-        """Returns times of sunrise and sunset
-        
         Returns
         -----
-        `dict`
-            dict containing `sunrise` and `sunset` times
+        `any`
+            Current value of the condition
         """
-        location = LocationInfo(os.environ.get("LATITUDE"), os.environ.get("LONGITUDE"))
-        s = sun(location.observer, date = datetime.now(), tzinfo = location.timezone)
+        if name == "daylight":
+            return self.sun_times.is_daylight(datetime.now(pytz.timezone("Europe/London")))
+        return getattr(self.reading, name)
+
+    def init_display(self, clear = True):
+        """Wake and optionally clear e-ink display
         
-        return {
-            "sunrise": s["sunrise"],
-            "sunset": s["sunset"]
-        }
+        Args
+        -----
+        clear: `bool`
+            Whether or not to do a full white refresh after waking
+        """
+        self.power.wake()
+        if clear:
+            logger.info('Clearing display')
+            self.epd.Clear()
+            self.state.set("updates_since_clear", 0)
+            self.state.set("last_clear", time.time())
+
+    def needs_clear(self):
+        """Check whether the anti-ghosting clear is due
         
+        Clears every `CLEAR_EVERY_UPDATES` updates or `CLEAR_EVERY_HOURS` hours,
+        whichever comes first. Setting either to 0 disables that trigger
+
+        Returns
+        -----
+        `bool`
+            True if the display should be cleared before the next update
+        """
+        every_updates = int(os.environ.get("CLEAR_EVERY_UPDATES", 10))
+        every_hours = float(os.environ.get("CLEAR_EVERY_HOURS", 24))
+        updates_since_clear = self.state.get("updates_since_clear")
+        last_clear = self.state.get("last_clear")
 
-    def init_display(self):
-        """Initialise and clear e-ink display"""
-        logger.info('Initialising and clearing display')
-        self.epd.init()
-        self.epd.Clear()
+        # Never cleared by this state file, so the panel contents are unknown
+        if updates_since_clear is None or last_clear is None:
+            return True
+        if every_updates > 0 and updates_since_clear >= every_updates:
+            return True
+        if every_hours > 0 and time.time() - last_clear >= every_hours * 3600:
+            return True
+        return False
 
-    def draw_reading(self, dev):
-        """Create and display reading image on e-ink display
+    def draw_text(self, image, xy, text, font):
+        """Draw text onto a 1-bit image, from the glyph cache unless it's disabled
         
         Args
         -----
-        dev: `bool`
-            If true, will display image in window and not affect e-ink display
+        image: `Image`
+            Black or red image to draw onto
+        xy: `tuple`
+            Position of the text's top left
+        text: `str`
+            Text to draw
+        font: `tuple`
+            Font file and size
+        """
+        if self.use_glyph_cache:
+            self.glyph_cache.draw_text(image, xy, text, *font)
+        else:
+            ImageDraw.Draw(image).text(xy, text, font = self.glyph_cache.get_font(*font))
+
+    def get_layout_hash(self):
+        """Returns a hash of everything that affects the static layer
+
+        Returns
+        -----
+        `str`
+            hex digest of layout, canvas size and fonts
+        """
+        fonts = [(font_file, size, os.path.getsize(os.path.join(font_dir, font_file))) for font_file, size in (self.font_header, self.font_body)]
+        layout = (HEADER, DIVIDERS, LINE_SPACING, START_Y, COLUMNS, self.canvas_size, fonts, self.use_glyph_cache)
+        return hashlib.sha1(repr(layout).encode()).hexdigest()
+
+    def draw_static(self):
+        """Draw the parts of the layout that never change onto blank black and red images"""
+        self.new_canvas()
+        self.draw_text(self.BlackImage, HEADER[0], HEADER[1], self.font_header)
+        for divider in DIVIDERS:
+            self.draw_black.line(divider, fill = 0)
+        for column in COLUMNS:
+            for j, (_, label, _) in enumerate(column["rows"]):
+                self.draw_text(self.RedImage, (column["label_x"], START_Y + (j * LINE_SPACING)), label, self.font_body)
+
+    def get_static_layer(self):
+        """Returns the static layer, drawing it only if it isn't cached in memory or on disk
+
+        Returns
+        -----
+        `tuple(Image)`
+            black and red images of the static layer
         """
+        layout_hash = self.get_layout_hash()
+        if layout_hash in self.static_layers:
+            return self.static_layers[layout_hash]
+
+        path = state_path(f"static_layer_{layout_hash[:16]}.bin")
+        plane_size = len(Image.new('1', self.canvas_size).tobytes())
+        layer = None
+        if os.path.exists(path):
+            with open(path, "rb") as f_read:
+                data = f_read.read()
+            if len(data) == plane_size * 2:
+                logger.debug("Loaded static layer from disk")
+                layer = (Image.frombytes('1', self.canvas_size, data[:plane_size]), Image.frombytes('1', self.canvas_size, data[plane_size:]))
+
+        if layer is None:
+            logger.debug("Drawing static layer")
+            self.draw_static()
+            layer = (self.BlackImage, self.RedImage)
+            write_atomic(path, layer[0].tobytes() + layer[1].tobytes())
+
+        self.static_layers[layout_hash] = layer
+        return layer
+
+    def draw(self):
+        """Draw the current reading onto the black and red images"""
         logger.info('Drawing reading display')
-        # Create title, last reading time, and dividers
-        self.draw_black.text((2, 2), 'Weathervane', font = self.font_header)
-        self.draw_black.text((138, 9), f'As of: {self.reading.time_str}', font = self.font_caption)
-        self.draw_black.line((0, 26, 250, 26), fill = 0)
-        self.draw_black.line((124, 26, 124, 122), fill = 0)
-
-        # Reading content
-        line_spacing = 24
-        red_l_start_x = 2
-        red_r_start_x = 129
-        blk_l_start_x = 18
-        blk_r_start_x = 148
-        start_y = 30
-        ind_l_start_x = 114
-        ind_r_start_x = 240
-        ind_start_y = 36
-
-        columns = ({
-            "temperature": ("T:", f"{self.reading.temperature} °C"),
-            "pressure": ("P:", f"{self.reading.pressure} hPA"),
-            "humidity": ("H:", f"{self.reading.humidity} %"),
-            "luminance": ("L:", f"{self.reading.luminance} Lx"),
-        },
-        {
-            "rain": ("R:", f"{self.reading.rain} mm"),
-            "wind_speed": ("W:", f"{self.reading.wind_speed} m/s"),
-            "wind_direction": ("D:", f"{self.reading.wind_direction}")
-        })
+        # Start from the static layer so only the reading itself is drawn each time
+        self.new_canvas(self.get_static_layer())
+
+        self.draw_text(self.BlackImage, TIME_POSITION, f'As of: {self.reading.time_str}', self.font_caption)
+        if self.stale:
+            self.draw_text(self.RedImage, STALE_POSITION, '!', self.font_body)
+
+        records = self.graph.get_records(self.reading.timestamp) if self.graph is not None else None
 
         # Programatically create reading display
-        for i, column in enumerate(columns):
-            for j, readingData in enumerate(column.items()):
-                self.draw_red.text((red_l_start_x if i == 0 else red_r_start_x, start_y + (j * line_spacing)), readingData[1][0], font = self.font_body)
-                self.draw_black.text((blk_l_start_x if i == 0 else blk_r_start_x, start_y + (j * line_spacing)), readingData[1][1], font = self.font_body)
-                if readingData[0] != "wind_direction":
-                    self.draw_red.polygon(self.get_polygon_coords((ind_l_start_x if i == 0 else ind_r_start_x, ind_start_y + (j * line_spacing)), self.reading.changes[readingData[0]]), fill = 0)
+        for column in COLUMNS:
+            for j, (name, _, value_format) in enumerate(column["rows"]):
+                if records is not None and name != "wind_direction":
+                    box = (column["value_x"], START_Y + (j * LINE_SPACING) + 2, column["indicator_x"] - 4, START_Y + (j * LINE_SPACING) + 18)
+                    for line in self.graph.get_lines(records, name, self.reading.timestamp, box):
+                        if len(line) > 2:
+                            self.draw_black.line(line, fill = 0)
+                        else:
+                            self.draw_black.point(line, fill = 0)
+                else:
+                    self.draw_text(self.BlackImage, (column["value_x"], START_Y + (j * LINE_SPACING)), value_format.format(getattr(self.reading, name)), self.font_body)
+                if name != "wind_direction":
+                    self.draw_red.polygon(self.get_polygon_coords((column["indicator_x"], IND_START_Y + (j * LINE_SPACING)), self.reading.changes[name]), fill = 0)
 
         # Add weather icon
-        self.RedImage.paste(self.get_weather_icon(), (224, 96))
+        self.RedImage.paste(self.get_weather_icon(), ICON_POSITION)
+
+        # Persist any glyphs rasterised for the first time
+        self.glyph_cache.save()
+
+    def render(self):
+        """Draw the current reading and convert it to e-ink display buffers
+
+        Returns
+        -----
+        `tuple(bytes)`
+            black and red buffers ready to send to the e-ink display
+        """
+        self.draw()
+        return self.to_native(self.BlackImage), self.to_native(self.RedImage)
+
+    def to_native(self, image):
+        """Convert a canvas image to a buffer in the panel's native RAM layout
+
+        Args
+        -----
+        image: `Image`
+            1-bit canvas image
+
+        Returns
+        -----
+        `bytes`
+            packed buffer ready to send to the e-ink display
+        """
+        return self.epd.getbuffer(image.transpose(ORIENTATIONS[self.orientation]))
+
+    def get_frame_hash(self, black, red):
+        """Return a hash identifying the contents of a rendered frame
+
+        Args
+        -----
+        black: `bytes`
+            Black buffer from `render`
+        red: `bytes`
+            Red buffer from `render`
 
+        Returns
+        -----
+        `str`
+            hex digest of both buffers
+        """
+        frame_hash = hashlib.sha1(black)
+        frame_hash.update(red)
+        return frame_hash.hexdigest()
 
+    def draw_reading(self, dev):
+        """Create and display reading image on e-ink display
+        
+        Args
+        -----
+        dev: `bool`
+            If true, will display image in window and not affect e-ink display
+        """
         # If dev == true, display in window
         if dev:
+            self.draw()
             dev_image = Image.composite(self.BlackImage, self.RedImage, self.RedImage)
             dev_image.show()
         else:
-            # Flip images to compensate for display orientation in the case I'm using
-            BlackDisplayImg = self.BlackImage.transpose(Image.ROTATE_180)
-            RedDisplayImg = self.RedImage.transpose(Image.ROTATE_180)
-            # Send image to e-ink display and draw
-            self.epd.display(self.epd.getbuffer(BlackDisplayImg), self.epd.getbuffer(RedDisplayImg))
-
-    def sleep(self, clear_display):
-        """Set the e-ink display to sleep mode and optionally clear display
-        
+            # Through update so the panel is woken first and unchanged frames are skipped
+            self.update()
+
+    def get_dirty_regions(self, old, new):
+        """Returns rectangles covering every byte that differs between two frames
+
+        Rows of the panel's RAM that change are merged into bands, so regions are
+        aligned to 8 pixel columns and separated by unchanged rows
+
         Args
         -----
-        clear_display: `bool`
-            Whether or not to clear display before sleeping
+        old: `tuple(bytes)`
+            black and red buffers currently in the panel's RAM
+        new: `tuple(bytes)`
+            black and red buffers to upload
+
+        Returns
+        -----
+        `list(tuple)`
+            regions as (x start byte, y start, x end byte, y end), inclusive
         """
-        if clear_display:
-            logger.info("Clearing display")
-            self.epd.Clear()
-        
-        logger.info("Sleeping")
-        self.epd.sleep()
+        linewidth = self.epd.linewidth
+        regions = []
+        region = None
+        for y in range(self.epd.height):
+            start = y * linewidth
+            end = start + linewidth
+            if old[0][start:end] == new[0][start:end] and old[1][start:end] == new[1][start:end]:
+                if region is not None:
+                    regions.append(tuple(region))
+                    region = None
+                continue
+
+            dirty = [x for x in range(linewidth) if old[0][start + x] != new[0][start + x] or old[1][start + x] != new[1][start + x]]
+            if region is None:
+                region = [dirty[0], y, dirty[-1], y]
+            else:
+                region = [min(region[0], dirty[0]), region[1], max(region[2], dirty[-1]), y]
+        if region is not None:
+            regions.append(tuple(region))
+        return regions
+
+    def push(self, black, red):
+        """Upload a frame and refresh the e-ink display, only sending changed regions if the panel's RAM contents are known
+
+        Falls back to a full upload when more than `PARTIAL_UPLOAD_THRESHOLD` of the frame
+        (a fraction, default 0.5) has changed
+
+        Args
+        -----
+        black: `bytes`
+            Black buffer from `render`
+        red: `bytes`
+            Red buffer from `render`
+        """
+        old = (self.epd.ram[0x24], self.epd.ram[0x26])
+        if None in old:
+            self.epd.display(black, red)
+            logger.info(f"Sent {self.epd.bytes_sent} bytes, full upload as display RAM contents are unknown")
+            return
+
+        regions = self.get_dirty_regions(old, (black, red))
+        dirty_bytes = sum((x_end - x_start + 1) * (y_end - y_start + 1) for x_start, y_start, x_end, y_end in regions)
+        threshold = float(os.environ.get("PARTIAL_UPLOAD_THRESHOLD", 0.5))
+        if dirty_bytes > len(black) * threshold:
+            self.epd.display(black, red)
+            logger.info(f"Sent {self.epd.bytes_sent} bytes, full upload as {dirty_bytes} of {len(black)} bytes per plane changed")
+        else:
+            self.epd.display_regions(black, red, regions)
+            logger.info(f"Sent {self.epd.bytes_sent} bytes in {len(regions)} regions")
+
+    def update(self, force_clear = False):
+        """Render the current reading and refresh the e-ink display only if the frame has changed
+
+        The panel is left awake, call `rest` or `cleanup` afterwards
+
+        Args
+        -----
+        force_clear: `bool`
+            If true, clear the display and refresh even if the frame hasn't changed
+
+        Returns
+        -----
+        `bool`
+            True if the e-ink display was refreshed
+        """
+        black, red = self.render()
+        return self.show(black, red, force_clear)
+
+    def show(self, black, red, force_clear = False):
+        """Refresh the e-ink display with a rendered frame only if it has changed
+
+        Safe to call from a different thread to the one rendering. The panel is left awake,
+        call `rest` or `cleanup` afterwards
+
+        Args
+        -----
+        black: `bytes`
+            Black buffer from `render`
+        red: `bytes`
+            Red buffer from `render`
+        force_clear: `bool`
+            If true, clear the display and refresh even if the frame hasn't changed
+
+        Returns
+        -----
+        `bool`
+            True if the e-ink display was refreshed
+        """
+        frame_hash = self.get_frame_hash(black, red)
+
+        with self.panel_lock:
+            if not force_clear and frame_hash == self.state.get("frame_hash"):
+                hits = self.state.get("frame_hits", 0) + 1
+                self.state.set("frame_hits", hits)
+                self.state.save()
+                logger.info(f"Frame unchanged, skipping display refresh (frame cache hit {hits}, misses {self.state.get('frame_misses', 0)})")
+                return False
+
+            misses = self.state.get("frame_misses", 0) + 1
+            logger.info(f"Frame changed, refreshing display (frame cache miss {misses}, hits {self.state.get('frame_hits', 0)})")
+            # only log the phases of this update
+            self.epd.busy_times = {}
+            self.init_display(force_clear or self.needs_clear())
+            self.push(black, red)
+            logger.info("Display busy times: " + ", ".join(f"{phase} {ms:.0f} ms" for phase, ms in self.epd.busy_times.items()))
+            self.state.set("updates_since_clear", self.state.get("updates_since_clear", 0) + 1)
+            self.state.set("frame_hash", frame_hash)
+            self.state.set("frame_misses", misses)
+            self.state.save()
+            return True
+
+    def rest(self, idle = None):
+        """Put the e-ink display in the lowest power state worth it until the next update
+
+        Args
+        -----
+        idle: `float`
+            Expected seconds until the next update, None to power off
+        """
+        # Nothing to power down if the panel was never woken, rendering alone doesn't touch hardware
+        if self._power is None:
+            return
+        with self.panel_lock:
+            self.epd.busy_times = {}
+            self.power.rest(idle)
+            if self.epd.busy_times:
+                logger.info("Display busy times: " + ", ".join(f"{phase} {ms:.0f} ms" for phase, ms in self.epd.busy_times.items()))
+        logger.info(f"Display {self.power.state}, time " + ", ".join(f"{state} {seconds:.0f}s" for state, seconds in self.power.get_times().items()))
 
     def cleanup(self):
         """Run cleanup before exiting"""
-        epd2in13b_V4.epdconfig.module_exit(cleanup=True)
+        # Nothing to release if the panel was never woken, e.g. the frame was unchanged
+        if self._power is None:
+            return
+        with self.panel_lock:
+            self.rest()
+            epd2in13b_V4.epdconfig.module_exit(cleanup=True)
+            self._epd.ram = {0x24: None, 0x26: None}
@@ -0,0 +1,141 @@
+import os
+import struct
+import logging
+from PIL import Image, ImageDraw, ImageFont
+from state.State import state_path, write_atomic, set_aside
+
+logger = logging.getLogger(__name__)
+
+font_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../font")
+
+MAGIC = b"GLYPH1"
+# font size, codepoint, advance, x offset, y offset, width, height
+GLYPH_FORMAT = struct.Struct("<BIfhhHH")
+
+class GlyphCache:
+    """1-bit glyph bitmaps and advances by (font, size, character), persisted between runs
+
+    Fonts are only loaded with FreeType when a glyph isn't cached yet
+    """
+    def __init__(self, filename = "glyphs.bin"):
+        self.path = state_path(filename)
+        self.fonts = {}
+        self.glyphs = {}
+        self.dirty = False
+        self.load()
+
+    def get_font(self, font_file, size):
+        """Return a loaded font
+
+        Args
+        -----
+        font_file: `str`
+            File name of font in the font directory
+        size: `int`
+            Font size
+
+        Returns
+        -----
+        `FreeTypeFont`
+            Loaded font
+        """
+        if (font_file, size) not in self.fonts:
+            self.fonts[(font_file, size)] = ImageFont.truetype(os.path.join(font_dir, font_file), size)
+        return self.fonts[(font_file, size)]
+
+    def get_glyph(self, font_file, size, char):
+        """Return a glyph, rasterising and caching it if needed
+
+        Args
+        -----
+        font_file: `str`
+            File name of font in the font directory
+        size: `int`
+            Font size
+        char: `str`
+            Single character
+
+        Returns
+        -----
+        `tuple`
+            advance, x offset, y offset and 1-bit mask of the glyph
+        """
+        key = (font_file, size, char)
+        if key not in self.glyphs:
+            font = self.get_font(font_file, size)
+            left, top, right, bottom = font.getbbox(char)
+            mask = Image.new('1', (max(right - left, 0), max(bottom - top, 0)), 0)
+            if mask.width and mask.height:
+                ImageDraw.Draw(mask).text((-left, -top), char, font = font, fill = 1)
+            self.glyphs[key] = (font.getlength(char), left, top, mask)
+            self.dirty = True
+        return self.glyphs[key]
+
+    def draw_text(self, image, xy, text, font_file, size):
+        """Draw text in black onto a 1-bit image from cached glyphs
+
+        Args
+        -----
+        image: `Image`
+            1-bit image to draw onto
+        xy: `tuple`
+            Position of the text's top left, as with `ImageDraw.text`
+        text: `str`
+            Text to draw
+        font_file: `str`
+            File name of font in the font directory
+        size: `int`
+            Font size
+        """
+        x, y = xy
+        for char in text:
+            advance, left, top, mask = self.get_glyph(font_file, size, char)
+            if mask.width and mask.height:
+                image.paste(0, (round(x) + left, y + top), mask)
+            x += advance
+
+    def load(self):
+        """Load cached glyphs from file, skipping fonts that have changed since"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f_read:
+            data = f_read.read()
+        if not data.startswith(MAGIC):
+            logger.warning("Ignoring glyph cache with unknown format")
+            return
+
+        offset = len(MAGIC)
+        try:
+            while offset < len(data):
+                name_length, font_file_size = struct.unpack_from("<BI", data, offset)
+                offset += 5
+                font_file = data[offset:offset + name_length].decode()
+                offset += name_length
+                size, codepoint, advance, left, top, width, height = GLYPH_FORMAT.unpack_from(data, offset)
+                offset += GLYPH_FORMAT.size
+                mask_length = ((width + 7) // 8) * height
+                mask = Image.frombytes('1', (width, height), data[offset:offset + mask_length])
+                offset += mask_length
+                font_path = os.path.join(font_dir, font_file)
+                if os.path.exists(font_path) and os.path.getsize(font_path) == font_file_size:
+                    self.glyphs[(font_file, size, chr(codepoint))] = (advance, left, top, mask)
+        except (struct.error, ValueError):
+            # glyphs are rendered again as needed
+            set_aside(self.path)
+            self.glyphs = {}
+            return
+        logger.debug(f"Loaded {len(self.glyphs)} cached glyphs")
+
+    def save(self):
+        """Write cached glyphs to file if any have been added"""
+        if not self.dirty:
+            return
+        chunks = [MAGIC]
+        for (font_file, size, char), (advance, left, top, mask) in self.glyphs.items():
+            name = font_file.encode()
+            chunks.append(struct.pack("<BI", len(name), os.path.getsize(os.path.join(font_dir, font_file))))
+            chunks.append(name)
+            chunks.append(GLYPH_FORMAT.pack(size, ord(char), advance, left, top, mask.width, mask.height))
+            chunks.append(mask.tobytes())
+        write_atomic(self.path, b"".join(chunks))
+        self.dirty = False
@@ -0,0 +1,73 @@
+import numpy as np
+from history.History import FIELDS, RECORD_FORMAT
+
+# numpy view of a history record, matching RECORD_FORMAT
+RECORD_DTYPE = np.dtype([("timestamp", "<i8")] + [(field, "<f8") for field in FIELDS] + [("wind_direction", "<u2"), ("padding", "V6")])
+assert RECORD_DTYPE.itemsize == RECORD_FORMAT.size
+
+class Graph:
+    """Sparklines of reading history, downsampled and scaled with NumPy"""
+    def __init__(self, history, hours = 24):
+        self.history = history
+        self.span = int(hours * 3600)
+
+    def get_records(self, end):
+        """Returns the records in the graph's time span as a structured array
+
+        Args
+        -----
+        end: `int`
+            Unix timestamp the span ends at, inclusive
+
+        Returns
+        -----
+        `ndarray`
+            records oldest first
+        """
+        segments = self.history.get_segments(self.history.find(end - self.span), self.history.find(end + 1))
+        if not segments:
+            return np.empty(0, dtype = RECORD_DTYPE)
+        return np.concatenate([np.frombuffer(segment, dtype = RECORD_DTYPE) for segment in segments])
+
+    def get_lines(self, records, field, end, box):
+        """Returns polylines of a value's history scaled into a box, one point per pixel column
+
+        Records are averaged into one bin per column, and columns with no records split the line
+
+        Args
+        -----
+        records: `ndarray`
+            records from `get_records`
+        field: `str`
+            Name of value to plot
+        end: `int`
+            Unix timestamp at the right edge of the box
+        box: `tuple`
+            left, top, right and bottom of the box in pixels, inclusive
+
+        Returns
+        -----
+        `list(list)`
+            flat [x0, y0, x1, y1, ...] point lists, ready for `ImageDraw.line`
+        """
+        left, top, right, bottom = box
+        width = right - left + 1
+        bins = ((records["timestamp"] - (end - self.span)) * width // (self.span + 1)).clip(0, width - 1)
+        counts = np.bincount(bins, minlength = width)
+        sums = np.bincount(bins, weights = records[field], minlength = width)
+        filled = counts > 0
+        if not filled.any():
+            return []
+
+        means = sums[filled] / counts[filled]
+        low, high = means.min(), means.max()
+        if high > low:
+            ys = bottom - (means - low) * (bottom - top) / (high - low)
+        else:
+            ys = np.full(means.shape, (top + bottom) / 2)
+        xs = np.flatnonzero(filled) + left
+        points = np.column_stack((xs, np.rint(ys))).astype(int)
+
+        # split wherever a column has no data
+        breaks = np.flatnonzero(np.diff(xs) > 1) + 1
+        return [line.ravel().tolist() for line in np.split(points, breaks)]
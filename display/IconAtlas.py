@@ -0,0 +1,86 @@
+import os
+import json
+import logging
+import operator
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+icon_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "icons")
+
+OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+class IconAtlas:
+    """Weather icons held in memory as 1-bit images, and the rules for choosing between them
+
+    Every bmp in the icon directory is loaded by name on first use. `icons.json` lists
+    rules in priority order, each naming an icon and the conditions it needs, e.g.
+    `{"icon": "rain", "when": {"rain": [">", 0]}}`. A rule with no conditions always matches
+    """
+    def __init__(self, directory = icon_dir):
+        self.directory = directory
+        self.icons = None
+        self.rules = None
+
+    def load(self):
+        """Load every icon and the icon rules"""
+        icons = {}
+        for filename in sorted(os.listdir(self.directory)):
+            name, ext = os.path.splitext(filename)
+            if ext.lower() == ".bmp":
+                with Image.open(os.path.join(self.directory, filename)) as icon:
+                    icons[name] = icon.convert('1')
+        with open(os.path.join(self.directory, "icons.json"), "r") as f_read:
+            rules = json.load(f_read)
+
+        for rule in rules:
+            if rule["icon"] not in icons:
+                raise ValueError(f"Icon rule refers to missing icon {rule['icon']}.bmp")
+        logger.debug(f"Loaded {len(icons)} weather icons")
+        self.icons = icons
+        self.rules = rules
+
+    def get(self, name):
+        """Return an icon by name
+
+        Args
+        -----
+        name: `str`
+            File name of icon without extension
+
+        Returns
+        -----
+        `Image`
+            1-bit icon image, ready to paste into the red image
+        """
+        if self.icons is None:
+            self.load()
+        return self.icons[name]
+
+    def choose(self, get_value):
+        """Return the first icon whose conditions all match
+
+        Args
+        -----
+        get_value: `function`
+            Called with a condition name, e.g. `rain` or `daylight`, returns the current value.
+            Only called for conditions a rule actually checks
+
+        Returns
+        -----
+        `Image`
+            1-bit icon image
+        """
+        if self.rules is None:
+            self.load()
+        for rule in self.rules:
+            if all(OPERATORS[op](get_value(name), value) for name, (op, value) in rule["when"].items()):
+                return self.icons[rule["icon"]]
+        raise ValueError("No icon rule matched current conditions")
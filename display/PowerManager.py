@@ -0,0 +1,93 @@
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class PowerManager:
+    """Moves the panel between power states, picking the cheapest that suits the wait until the next update
+
+    - `awake`: ready for the next frame as it is
+    - `asleep`: deep sleep with power and SPI kept up, so RAM contents survive and waking
+      only needs a reset and the register setup
+    - `off`: power and SPI cut, RAM contents lost, waking needs a full init
+
+    The panel stays awake if the next update is due within `POWER_AWAKE_SECONDS` (default 60),
+    sleeps if it's due within `POWER_OFF_SECONDS` (default 3600), and is powered off otherwise
+    """
+    STATES = ("awake", "asleep", "off")
+
+    def __init__(self, epd):
+        self.epd = epd
+        self.awake_seconds = float(os.environ.get("POWER_AWAKE_SECONDS", 60))
+        self.off_seconds = float(os.environ.get("POWER_OFF_SECONDS", 3600))
+        self.state = "off"
+        self.since = time.monotonic()
+        # seconds spent in each state
+        self.times = {state: 0.0 for state in self.STATES}
+
+    def enter(self, state):
+        """Record a change of power state
+
+        Args
+        -----
+        state: `str`
+            One of `STATES`
+        """
+        now = time.monotonic()
+        self.times[self.state] += now - self.since
+        self.state = state
+        self.since = now
+
+    def get_times(self):
+        """Returns time spent in each power state so far
+
+        Returns
+        -----
+        `dict`
+            seconds spent in each of `STATES`, including the current one
+        """
+        times = dict(self.times)
+        times[self.state] += time.monotonic() - self.since
+        return times
+
+    def wake(self):
+        """Get the panel ready to draw, from whichever state it's in"""
+        if self.state == "awake":
+            logger.info("Display already awake")
+            return
+        if self.state == "asleep":
+            logger.info("Waking display from deep sleep")
+            self.epd.wake()
+        else:
+            logger.info("Initialising display")
+            if self.epd.init() != 0:
+                raise IOError("Failed to initialise display")
+        self.enter("awake")
+
+    def rest(self, idle = None):
+        """Drop to the lowest power state worth leaving the panel in until the next update
+
+        Args
+        -----
+        idle: `float`
+            Expected seconds until the next update, None to power off
+        """
+        if idle is not None and idle < self.awake_seconds:
+            target = "awake"
+        elif idle is not None and idle < self.off_seconds:
+            target = "asleep"
+        else:
+            target = "off"
+
+        # resting never wakes the panel, so an asleep panel due to stay awake stays asleep
+        if target == self.state or (target == "awake" and self.state != "awake"):
+            return
+        if self.state == "awake":
+            logger.info("Sleeping")
+            self.epd.deep_sleep()
+            self.enter("asleep")
+        if target == "off":
+            logger.info("Powering off display")
+            self.epd.power_off()
+            self.enter("off")
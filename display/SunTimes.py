@@ -0,0 +1,147 @@
+import os
+import logging
+from array import array
+from datetime import date, timedelta
+import pytz
+from astral import LocationInfo
+from astral.sun import sun, elevation
+from state.State import state_path, write_atomic
+
+logger = logging.getLogger(__name__)
+
+TIMEZONE = "Europe/London"
+# days in a table, enough for a leap year
+TABLE_DAYS = 366
+
+class SunTimes:
+    """Sunrise and sunset at a location, worked out at most once per day
+
+    Times are memoised per location and date. With `SUN_TABLE=1` a year of times is
+    worked out once and kept in `sun_table_<year>_<lat>_<lon>.bin` under `STATE_DIR`,
+    so deciding day or night is a single lookup
+    """
+    # Shared by every SunTimes, keyed by (latitude, longitude, date)
+    memo = {}
+
+    def __init__(self, latitude, longitude, use_table = False):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.location = LocationInfo(latitude = latitude, longitude = longitude, timezone = TIMEZONE)
+        self.tz = pytz.timezone(TIMEZONE)
+        self.use_table = use_table
+        self.tables = {}
+
+    @classmethod
+    def from_env(cls):
+        """Returns sun times for the `LATITUDE` and `LONGITUDE` environment variables
+
+        Returns
+        -----
+        `SunTimes`
+            sun times at the configured location
+
+        Raises
+        -----
+        `ValueError`
+            if either coordinate is missing, not a number or out of range
+        """
+        coordinates = []
+        for name, limit in (("LATITUDE", 90), ("LONGITUDE", 180)):
+            value = os.environ.get(name)
+            try:
+                coordinate = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{name} must be set to a number of degrees, got {value!r}") from None
+            if not -limit <= coordinate <= limit:
+                raise ValueError(f"{name} must be between -{limit} and {limit}, got {coordinate}")
+            coordinates.append(coordinate)
+        return cls(*coordinates, os.environ.get("SUN_TABLE", "0") == "1")
+
+    def get(self, day):
+        """Returns times of sunrise and sunset on a day
+
+        Args
+        -----
+        day: `date`
+            Local date
+
+        Returns
+        -----
+        `dict`
+            dict containing `sunrise` and `sunset` times, or None if the sun doesn't rise or set that day
+        """
+        key = (self.latitude, self.longitude, day)
+        if key not in self.memo:
+            try:
+                s = sun(self.location.observer, date = day, tzinfo = self.tz)
+                self.memo[key] = {"sunrise": s["sunrise"], "sunset": s["sunset"]}
+            except ValueError:
+                # polar day or night
+                self.memo[key] = None
+        return self.memo[key]
+
+    def get_table(self, year):
+        """Returns a year of sunrise and sunset times, loading or generating it if needed
+
+        Args
+        -----
+        year: `int`
+            Year of table
+
+        Returns
+        -----
+        `array`
+            Unix timestamps of sunrise and sunset for each day of the year in turn,
+            0 on days the sun doesn't rise or set
+        """
+        if year in self.tables:
+            return self.tables[year]
+
+        path = state_path(f"sun_table_{year}_{self.latitude:.4f}_{self.longitude:.4f}.bin")
+        table = array("q")
+        if os.path.exists(path):
+            with open(path, "rb") as f_read:
+                data = f_read.read()
+            if len(data) == TABLE_DAYS * 2 * table.itemsize:
+                table.frombytes(data)
+
+        if not table:
+            logger.info(f"Generating sunrise and sunset table for {year}")
+            first = date(year, 1, 1)
+            for offset in range(TABLE_DAYS):
+                times = self.get(first + timedelta(days = offset))
+                if times is None:
+                    table.extend((0, 0))
+                else:
+                    table.extend((int(times["sunrise"].timestamp()), int(times["sunset"].timestamp())))
+            write_atomic(path, table.tobytes())
+
+        self.tables[year] = table
+        return table
+
+    def is_daylight(self, now):
+        """Check whether the sun is up
+
+        Args
+        -----
+        now: `datetime`
+            Timezone aware time to check
+
+        Returns
+        -----
+        `bool`
+            True if it's between sunrise and sunset
+        """
+        local = now.astimezone(self.tz)
+        if self.use_table:
+            table = self.get_table(local.year)
+            index = (local.timetuple().tm_yday - 1) * 2
+            sunrise, sunset = table[index], table[index + 1]
+            if sunrise:
+                return sunrise < now.timestamp() < sunset
+        else:
+            times = self.get(local.date())
+            if times is not None:
+                return times["sunrise"] < now < times["sunset"]
+        # the sun doesn't rise or set today, so it's up all day or not at all
+        return elevation(self.location.observer, now) > 0
@@ -0,0 +1,124 @@
+import os
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from fetch.ResponseCache import ResponseCache
+
+logger = logging.getLogger(__name__)
+
+class Fetcher:
+    """Fetch readings from the Weathervane API over a persistent session
+
+    Requests time out after `API_CONNECT_TIMEOUT`/`API_READ_TIMEOUT` seconds and failed
+    connections or 5xx responses are retried `API_RETRIES` times with exponential backoff.
+    The ETag and Last-Modified of the cached response are sent back so unchanged data isn't downloaded again.
+
+    Good responses are kept in a `ResponseCache`, refreshed in the background so drawing never waits
+    on the API for more than `API_WAIT` seconds
+    """
+    def __init__(self, api_url, validate = None):
+        self.api_url = api_url
+        self.validate = validate
+        self.cache = ResponseCache()
+        self.thread = None
+        self.result = None
+        self.timeout = (float(os.environ.get("API_CONNECT_TIMEOUT", 5)), float(os.environ.get("API_READ_TIMEOUT", 15)))
+        retry = Retry(
+            total = int(os.environ.get("API_RETRIES", 3)),
+            backoff_factor = float(os.environ.get("API_RETRY_BACKOFF", 1)),
+            status_forcelist = (500, 502, 503, 504),
+            allowed_methods = ("GET",),
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(max_retries = retry))
+        self.session.mount("https://", HTTPAdapter(max_retries = retry))
+
+    def fetch(self, conditional = True):
+        """Fetch the latest readings
+
+        Args
+        -----
+        conditional: `bool`
+            If true, ask the API to only send data that has changed since the last fetch
+
+        Returns
+        -----
+        `tuple`
+            Parsed API response and its `etag` and `last_modified` validators,
+            or None if it hasn't changed since the last fetch
+        """
+        # Only revalidate what's actually cached, a 304 is no use without a payload to fall back on
+        headers = {}
+        if conditional:
+            validators = self.cache.get_validators()
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+
+        r = self.session.get(self.api_url, headers = headers, timeout = self.timeout)
+        if r.status_code == 304:
+            logger.info("API response not modified since last fetch")
+            return None
+        r.raise_for_status()
+        data = r.json()
+        # Check the payload can be used before trusting its ETag
+        if self.validate is not None:
+            self.validate(data)
+        return data, {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+
+    def refresh(self, conditional = True):
+        """Fetch the latest readings into the cache, keeping the cached copy if anything goes wrong
+
+        Args
+        -----
+        conditional: `bool`
+            If true, ask the API to only send data that has changed since the last fetch
+
+        Returns
+        -----
+        `str`
+            `new`, `not_modified` or `failed`
+        """
+        try:
+            fetched = self.fetch(conditional)
+        except (IOError, ValueError, KeyError, IndexError, TypeError) as e:
+            logger.error(f"Failed to refresh readings, falling back to cached copy: {e}")
+            return "failed"
+
+        if fetched is None:
+            self.cache.touch()
+            return "not_modified"
+        self.cache.put(*fetched)
+        return "new"
+
+    def wait_for_refresh(self, conditional = True):
+        """Refresh the cache in the background, waiting up to `API_WAIT` seconds (default 10) for it to finish
+
+        A refresh that takes longer carries on and updates the cache for the next run
+
+        Args
+        -----
+        conditional: `bool`
+            If true, ask the API to only send data that has changed since the last fetch
+
+        Returns
+        -----
+        `str`
+            Result of `refresh`, or None if it's still running
+        """
+        if self.thread is None or not self.thread.is_alive():
+            self.result = None
+            self.thread = threading.Thread(target = self.run_refresh, args = (conditional,), name = "refresh")
+            self.thread.start()
+        self.thread.join(float(os.environ.get("API_WAIT", 10)))
+        if self.thread.is_alive():
+            logger.warning("API is slow to respond, drawing from cache")
+            return None
+        return self.result
+
+    def run_refresh(self, conditional):
+        """Thread target for `wait_for_refresh`"""
+        self.result = self.refresh(conditional)
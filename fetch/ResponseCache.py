@@ -0,0 +1,118 @@
+import os
+import time
+import logging
+import threading
+from state.State import State
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """Last good API response, its validators and when it was fetched, kept on disk so there's always something to draw
+
+    The ETag and Last-Modified are stored in the same file as the payload so they're always written together
+    """
+    def __init__(self, filename = "api_cache.json"):
+        self.state = State(filename)
+        self.lock = threading.Lock()
+
+    def get_data(self):
+        """Returns the cached API response, or None if nothing has been fetched yet"""
+        return self.state.get("data")
+
+    def get_entry(self):
+        """Returns the cached API response together with its version
+
+        Returns
+        -----
+        `tuple`
+            cached API response or None if nothing has been fetched yet, and the version to pass to `mark_displayed`
+        """
+        # read together so a response stored in between can't be paired with the wrong version
+        with self.lock:
+            return self.state.get("data"), self.state.get("version", 0)
+
+    def get_validators(self):
+        """Returns the validators of the cached response, none if nothing is cached
+
+        Returns
+        -----
+        `dict`
+            `etag` and `last_modified` headers of the cached response, if any
+        """
+        if self.get_data() is None:
+            return {}
+        return self.state.get("validators", {})
+
+    def put(self, data, validators = None):
+        """Replace the cached response with a freshly fetched one
+
+        Args
+        -----
+        data: `list`
+            Parsed API response
+        validators: `dict`
+            `etag` and `last_modified` headers of the response
+        """
+        with self.lock:
+            self.state.set("data", data)
+            self.state.set("version", self.state.get("version", 0) + 1)
+            self.state.set("validators", validators or {})
+            self.state.set("fetched_at", time.time())
+            self.state.set("displayed", False)
+            self.state.save()
+
+    def touch(self):
+        """Mark the cached response as confirmed current by the API"""
+        with self.lock:
+            # nothing to confirm, leave an empty cache looking stale
+            if self.get_data() is None:
+                return
+            self.state.set("fetched_at", time.time())
+            self.state.save()
+
+    def is_stale(self):
+        """Check whether the cached response is older than `STALE_AFTER_MINUTES`, default 30
+
+        Returns
+        -----
+        `bool`
+            True if the cached response is too old to be trusted
+        """
+        fetched_at = self.state.get("fetched_at")
+        if fetched_at is None:
+            return True
+        return time.time() - fetched_at > float(os.environ.get("STALE_AFTER_MINUTES", 30)) * 60
+
+    def is_displayed(self, stale):
+        """Check whether the cached response is already on the display
+
+        Args
+        -----
+        stale: `bool`
+            Whether the response is currently stale, so a change in staleness counts as not displayed
+
+        Returns
+        -----
+        `bool`
+            True if nothing has changed since the response was last displayed
+        """
+        return self.state.get("displayed", False) and self.state.get("displayed_stale") == stale
+
+    def mark_displayed(self, stale, version):
+        """Record that the cached response has been displayed
+
+        Args
+        -----
+        stale: `bool`
+            Whether it was displayed as stale
+        version: `int`
+            Version of the response that was drawn, from `get_entry`
+        """
+        with self.lock:
+            # a newer response stored while the old one was drawing hasn't been displayed yet
+            if self.state.get("version", 0) != version:
+                logger.info("Cached response replaced while drawing, leaving it to be displayed next run")
+                return
+            self.state.set("displayed", True)
+            self.state.set("displayed_stale", stale)
+            self.state.save()
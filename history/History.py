@@ -0,0 +1,324 @@
+import os
+import mmap
+import json
+import time
+import struct
+import logging
+from datetime import datetime
+import pytz
+from state.State import State, state_path, set_aside
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"WVHIST01"
+# magic, record size, capacity, index of oldest record, number of records
+HEADER_FORMAT = struct.Struct("<8sIIII")
+HEADER_SIZE = 64
+# timestamp, temperature, pressure, humidity, luminance, rain, wind speed, wind direction in degrees
+RECORD_FORMAT = struct.Struct("<q6dH6x")
+FIELDS = ("temperature", "pressure", "humidity", "luminance", "rain", "wind_speed")
+# wind direction of readings imported without one
+UNKNOWN_DIRECTION = 0xFFFF
+
+class History:
+    """Append-only ring buffer of readings in a memory-mapped file of fixed-width records
+
+    Holds the last `HISTORY_CAPACITY` readings (default 8928, 31 days at one every 5 minutes),
+    oldest first and in timestamp order, overwriting the oldest once full
+
+    Records reach the disk before the header that counts them. Like `State`, the header is
+    written at most once every `State.flush_interval` seconds and by `State.flush_all`
+    """
+    def __init__(self, filename = "history.bin", capacity = None):
+        self.path = state_path(filename)
+        # header changes not written to the file yet
+        self.dirty = False
+        self.written_at = None
+        if capacity is None:
+            capacity = int(os.environ.get("HISTORY_CAPACITY", 8928))
+        self.open(capacity)
+        State.instances.add(self)
+
+        # Carry over the single reading kept in the working directory before history existed
+        if self.count == 0 and os.path.exists("last_reading.json"):
+            self.import_json("last_reading.json")
+
+    def open(self, capacity):
+        """Open and map the history file, creating or resizing it if needed
+
+        Args
+        -----
+        capacity: `int`
+            Number of readings to keep
+        """
+        records = []
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f_read:
+                header = f_read.read(HEADER_SIZE)
+            magic, record_size, file_capacity, start, count = HEADER_FORMAT.unpack_from(header.ljust(HEADER_SIZE, b"\0"))
+            if (magic != MAGIC or record_size != RECORD_FORMAT.size or start >= max(file_capacity, 1) or count > file_capacity
+                    or os.path.getsize(self.path) != HEADER_SIZE + file_capacity * RECORD_FORMAT.size):
+                set_aside(self.path)
+            elif file_capacity != capacity:
+                # Keep the newest readings that fit, in a file of the new size
+                self.map()
+                self.repair()
+                records = [self.read(i) for i in range(max(self.count - capacity, 0), self.count)]
+                self.close()
+                os.remove(self.path)
+                logger.info(f"Resizing history from {file_capacity} to {capacity} readings")
+
+        if not os.path.exists(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok = True)
+            with open(self.path, "wb") as f_write:
+                f_write.write(HEADER_FORMAT.pack(MAGIC, RECORD_FORMAT.size, capacity, 0, 0).ljust(HEADER_SIZE, b"\0"))
+                f_write.truncate(HEADER_SIZE + capacity * RECORD_FORMAT.size)
+        self.map()
+        self.repair()
+        self.extend(records)
+
+    def map(self):
+        """Map the history file into memory and read its header"""
+        self.file = open(self.path, "r+b")
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        _, _, self.capacity, self.start, self.count = HEADER_FORMAT.unpack_from(self.mm)
+
+    def repair(self):
+        """Drop records a power cut left half written, so history stays in timestamp order"""
+        count = self.count
+        # newest counted by the header but never written
+        while self.count and (self.read(-1)[0] <= 0 or (self.count > 1 and self.read(-1)[0] <= self.read(-2)[0])):
+            self.count -= 1
+        # oldest overwritten by records the header doesn't count yet
+        while self.count > 1 and self.read(0)[0] > self.read(-1)[0]:
+            self.start = (self.start + 1) % self.capacity
+            self.count -= 1
+        if self.count != count:
+            logger.warning(f"Dropped {count - self.count} half written records from {self.path}")
+            self.dirty = True
+            self.flush()
+
+    def save(self):
+        """Write the header, unless it was written less than `State.flush_interval` seconds ago"""
+        self.flush(False)
+
+    def flush(self, force = True):
+        """Write records and then the header counting them if any have been added
+
+        Args
+        -----
+        force: `bool`
+            Write even if it was written less than `State.flush_interval` seconds ago
+        """
+        if not self.dirty:
+            return
+        if not force and self.written_at is not None and time.monotonic() - self.written_at < State.flush_interval:
+            return
+        # records first, so a header on disk never counts a record that isn't
+        self.mm.flush()
+        HEADER_FORMAT.pack_into(self.mm, 0, MAGIC, RECORD_FORMAT.size, self.capacity, self.start, self.count)
+        self.mm.flush()
+        self.dirty = False
+        self.written_at = time.monotonic()
+
+    def close(self):
+        """Flush and unmap the history file"""
+        self.flush()
+        self.mm.close()
+        self.file.close()
+
+    def offset(self, index):
+        """Returns the file offset of a record
+
+        Args
+        -----
+        index: `int`
+            Position of record, 0 being the oldest
+
+        Returns
+        -----
+        `int`
+            byte offset into the history file
+        """
+        return HEADER_SIZE + ((self.start + index) % self.capacity) * RECORD_FORMAT.size
+
+    def read(self, index):
+        """Returns a record
+
+        Args
+        -----
+        index: `int`
+            Position of record, 0 being the oldest. Negative indexes count back from the newest
+
+        Returns
+        -----
+        `tuple`
+            timestamp, the values in `FIELDS` order, and wind direction in degrees
+        """
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("history index out of range")
+        return RECORD_FORMAT.unpack_from(self.mm, self.offset(index))
+
+    def last(self):
+        """Returns the newest record, or None if history is empty"""
+        return self.read(-1) if self.count else None
+
+    def write(self, record):
+        """Write a record after the newest without writing the header, overwriting the oldest if full"""
+        if self.count < self.capacity:
+            RECORD_FORMAT.pack_into(self.mm, self.offset(self.count), *record)
+            self.count += 1
+        else:
+            RECORD_FORMAT.pack_into(self.mm, self.offset(0), *record)
+            self.start = (self.start + 1) % self.capacity
+        self.dirty = True
+
+    def append(self, record):
+        """Append a record
+
+        Args
+        -----
+        record: `tuple`
+            timestamp, the values in `FIELDS` order, and wind direction in degrees.
+            Must be newer than the newest record
+
+        Returns
+        -----
+        `bool`
+            True if the record was appended, False if it isn't newer than the newest
+        """
+        last = self.last()
+        if last is not None and record[0] <= last[0]:
+            return False
+        self.write(record)
+        self.save()
+        return True
+
+    def extend(self, records):
+        """Append records newer than the newest, packing them into the file in one write
+        and saving once
+
+        Args
+        -----
+        records: `list(tuple)`
+            timestamp, the values in `FIELDS` order, and wind direction in degrees, oldest first
+
+        Returns
+        -----
+        `int`
+            Number of records appended
+        """
+        last = self.last()
+        if last is not None:
+            records = [record for record in records if record[0] > last[0]]
+        # only the newest that fit in the ring are kept
+        records = records[-self.capacity:]
+        if not records:
+            return 0
+
+        packed = bytearray(len(records) * RECORD_FORMAT.size)
+        for i, record in enumerate(records):
+            RECORD_FORMAT.pack_into(packed, i * RECORD_FORMAT.size, *record)
+        # overwrite the oldest records to make room, then copy in at most two runs as the ring wraps
+        overflow = max(self.count + len(records) - self.capacity, 0)
+        self.start = (self.start + overflow) % self.capacity
+        self.count -= overflow
+        written = 0
+        while written < len(records):
+            physical = (self.start + self.count) % self.capacity
+            run = min(len(records) - written, self.capacity - physical)
+            offset = HEADER_SIZE + physical * RECORD_FORMAT.size
+            self.mm[offset:offset + run * RECORD_FORMAT.size] = packed[written * RECORD_FORMAT.size:(written + run) * RECORD_FORMAT.size]
+            self.count += run
+            written += run
+        self.dirty = True
+        self.save()
+        return len(records)
+
+    def find(self, timestamp):
+        """Returns the index of the first record at or after a timestamp
+
+        Args
+        -----
+        timestamp: `int`
+            Unix timestamp
+
+        Returns
+        -----
+        `int`
+            index of record, or `count` if every record is older
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if struct.unpack_from("<q", self.mm, self.offset(middle))[0] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def query(self, start, end):
+        """Returns records with timestamps from start up to but not including end
+
+        Args
+        -----
+        start: `int`
+            Unix timestamp
+        end: `int`
+            Unix timestamp
+
+        Returns
+        -----
+        `list(tuple)`
+            records oldest first
+        """
+        return [self.read(i) for i in range(self.find(start), self.find(end))]
+
+    def get_segments(self, first, last):
+        """Returns the raw bytes of a range of records, without copying
+
+        Records are contiguous in the file apart from where the ring wraps, so a range
+        is at most two segments. Suited to `numpy.frombuffer` and the like
+
+        Args
+        -----
+        first: `int`
+            Index of first record
+        last: `int`
+            Index after the last record
+
+        Returns
+        -----
+        `list(memoryview)`
+            one or two segments of packed records, oldest first
+        """
+        view = memoryview(self.mm)
+        segments = []
+        while first < last:
+            physical = (self.start + first) % self.capacity
+            run = min(last - first, self.capacity - physical)
+            offset = HEADER_SIZE + physical * RECORD_FORMAT.size
+            segments.append(view[offset:offset + run * RECORD_FORMAT.size])
+            first += run
+        return segments
+
+    def import_json(self, path):
+        """Import the reading from a `last_reading.json` file
+
+        Args
+        -----
+        path: `str`
+            Path to file
+        """
+        try:
+            with open(path, "r") as f_read:
+                last_reading = json.load(f_read)["reading"]
+            timestamp_obj = pytz.timezone("Europe/London").localize(datetime.strptime(last_reading["time_str"], '%d/%m/%y %H:%M'))
+            record = (int(timestamp_obj.timestamp()), *(float(last_reading[field]) for field in FIELDS), UNKNOWN_DIRECTION)
+        except (OSError, ValueError, KeyError, TypeError):
+            logger.warning(f"Could not import last reading from {path}, skipping")
+            return
+        if self.append(record):
+            logger.info(f"Imported last reading from {path}")
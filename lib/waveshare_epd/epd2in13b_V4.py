@@ -27,6 +27,7 @@
 # THE SOFTWARE.
 #
 
+import os
 import logging
 from . import epdconfig
 
@@ -34,16 +35,47 @@ from . import epdconfig
 EPD_WIDTH       = 122
 EPD_HEIGHT      = 250
 
+# Register setup sent by init() after SWRESET, as (command, data) pairs
+INIT_SEQUENCE = (
+    (0x01, bytes([0xf9, 0x00, 0x00])),  # Driver output control
+    (0x11, bytes([0x03])),              # data entry mode
+    (0x44, bytes([0x00, (EPD_WIDTH - 1) >> 3])),  # SET_RAM_X_ADDRESS_START_END_POSITION
+    (0x45, bytes([0x00, 0x00, (EPD_HEIGHT - 1) & 0xff, (EPD_HEIGHT - 1) >> 8])),  # SET_RAM_Y_ADDRESS_START_END_POSITION
+    (0x4E, bytes([0x00])),              # SET_RAM_X_ADDRESS_COUNTER
+    (0x4F, bytes([0x00, 0x00])),        # SET_RAM_Y_ADDRESS_COUNTER
+    (0x3C, bytes([0x05])),              # BorderWavefrom
+    (0x18, bytes([0x80])),              # Read built-in temperature sensor
+    (0x21, bytes([0x80, 0x80])),        # Display update control
+)
+
+# Longest a single busy phase may take before giving up, a full tri-colour refresh is ~15-20 s
+BUSY_TIMEOUT_MS = 60000
+# Longest to wait for BUSY to rise after the deep sleep command, the fixed delay this replaced
+SLEEP_TIMEOUT_MS = 2000
+
 logger = logging.getLogger(__name__)
 
+class EPDBusyTimeout(TimeoutError):
+    pass
+
 class EPD:
-    def __init__(self):
+    def __init__(self, busy_timeout_ms=None):
         self.reset_pin = epdconfig.RST_PIN
         self.dc_pin = epdconfig.DC_PIN
         self.busy_pin = epdconfig.BUSY_PIN
         self.cs_pin = epdconfig.CS_PIN
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
+        self.linewidth = (EPD_WIDTH + 7) // 8
+        if busy_timeout_ms is None:
+            busy_timeout_ms = int(os.environ.get("EPD_BUSY_TIMEOUT_MS", BUSY_TIMEOUT_MS))
+        self.busy_timeout_ms = busy_timeout_ms
+        # ms spent waiting on BUSY during the last reset, swreset, init, refresh and clear
+        self.busy_times = {}
+        # last contents written to the black (0x24) and red (0x26) RAM, None once power has been cut
+        self.ram = {0x24: None, 0x26: None}
+        # image bytes sent by the last display, display_regions or clear
+        self.bytes_sent = 0
 
     # hardware reset
     def reset(self):
@@ -75,81 +107,81 @@ class EPD:
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
         
+    # send (command, data) pairs, each payload in a single transfer
+    def send_sequence(self, sequence):
+        epdconfig.digital_write(self.cs_pin, 0)
+        for command, data in sequence:
+            epdconfig.digital_write(self.dc_pin, 0)
+            epdconfig.spi_writebyte([command])
+            if data:
+                epdconfig.digital_write(self.dc_pin, 1)
+                epdconfig.spi_writebyte2(data)
+        epdconfig.digital_write(self.cs_pin, 1)
+
     # judge e-Paper whether is busy
-    def busy(self):
+    def busy(self, phase="busy"):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) != 0): 
-            epdconfig.delay_ms(10)
-        logger.debug("e-Paper busy release")
+        elapsed = epdconfig.wait_busy_release(self.busy_pin, self.busy_timeout_ms)
+        if elapsed is None:
+            raise EPDBusyTimeout("e-Paper still busy after %d ms during %s" % (self.busy_timeout_ms, phase))
+        self.busy_times[phase] = elapsed
+        logger.debug("e-Paper busy release after %d ms (%s)" % (elapsed, phase))
 
     # set the display window
+    def windows_sequence(self, xstart, ystart, xend, yend):
+        return (
+            (0x44, bytes([(xstart>>3) & 0xff, (xend>>3) & 0xff])), # SET_RAM_X_ADDRESS_START_END_POSITION
+            (0x45, bytes([ystart & 0xff, (ystart >> 8) & 0xff, yend & 0xff, (yend >> 8) & 0xff])), # SET_RAM_Y_ADDRESS_START_END_POSITION
+        )
+
     def set_windows(self, xstart, ystart, xend, yend):
-        self.send_command(0x44) # SET_RAM_X_ADDRESS_START_END_POSITION
-        self.send_data((xstart>>3) & 0xff)
-        self.send_data((xend>>3) & 0xff)
-        
-        self.send_command(0x45) # SET_RAM_Y_ADDRESS_START_END_POSITION
-        self.send_data(ystart & 0xff)
-        self.send_data((ystart >> 8) & 0xff)
-        self.send_data(yend & 0xff)
-        self.send_data((yend >> 8) & 0xff)
+        self.send_sequence(self.windows_sequence(xstart, ystart, xend, yend))
         
     # set the display cursor(origin)
-    def set_cursor(self, xstart, ystart):
-        self.send_command(0x4E) # SET_RAM_X_ADDRESS_COUNTER
-        self.send_data(xstart & 0xff)
+    def cursor_sequence(self, xstart, ystart):
+        return (
+            (0x4E, bytes([xstart & 0xff])), # SET_RAM_X_ADDRESS_COUNTER
+            (0x4F, bytes([ystart & 0xff, (ystart >> 8) & 0xff])), # SET_RAM_Y_ADDRESS_COUNTER
+        )
 
-        self.send_command(0x4F) # SET_RAM_Y_ADDRESS_COUNTER
-        self.send_data(ystart & 0xff)
-        self.send_data((ystart >> 8) & 0xff)
+    def set_cursor(self, xstart, ystart):
+        self.send_sequence(self.cursor_sequence(xstart, ystart))
 
     # initialize 
     def init(self):
         if (epdconfig.module_init() != 0):
             return -1
-            
-        self.reset()
-
-        self.busy()
-        self.send_command(0x12)  # SWRESET
-        self.busy()   
-
-        self.send_command(0x01) # Driver output control      
-        self.send_data(0xf9)
-        self.send_data(0x00)
-        self.send_data(0x00)
 
-        self.send_command(0x11) # data entry mode       
-        self.send_data(0x03)
+        return self.wake()
 
-        self.set_windows(0, 0, self.width - 1, self.height - 1)
-        self.set_cursor(0, 0)
-
-        self.send_command(0x3C) # BorderWavefrom
-        self.send_data(0x05)	
+    # warm wake from deep sleep, power and SPI are still up and RAM contents are kept
+    def wake(self):
+        self.reset()
 
-        self.send_command(0x18) # Read built-in temperature sensor
-        self.send_data(0x80)	
+        self.busy("reset")
+        self.send_command(0x12)  # SWRESET
+        self.busy("swreset")
 
-        self.send_command(0x21) # Display update control
-        self.send_data(0x80)	
-        self.send_data(0x80)
+        self.send_sequence(INIT_SEQUENCE)
 
-        self.busy()
+        self.busy("init")
         
         return 0
 
     # turn on display
-    def ondisplay(self):
+    def ondisplay(self, phase="refresh"):
         self.send_command(0x20)
-        self.busy()
+        self.busy(phase)
 
-    # image converted to bytearray
+    # image converted to packed 1bpp bytes in the panel RAM layout
     def getbuffer(self, image):
         img = image
         imwidth, imheight = img.size
         if(imwidth == self.width and imheight == self.height):
-            img = img.convert('1')
+            # already in the native RAM layout, hand back the packed bytes without copying
+            if img.mode != '1':
+                img = img.convert('1')
+            return img.tobytes('raw')
         elif(imwidth == self.height and imheight == self.width):
             # image has correct dimensions, but needs to be rotated
             img = img.rotate(90, expand=True).convert('1')
@@ -161,14 +193,42 @@ class EPD:
         buf = bytearray(img.tobytes('raw'))
         return buf
 
+    # check whether a RAM plane already holds an image
+    def plane_unchanged(self, command, image):
+        if self.ram[command] is not None and self.ram[command] == bytes(image):
+            logger.debug("RAM 0x%02x unchanged, skipping" % command)
+            return True
+        return False
+
     # display image
     def display(self, imageblack, imagered):
-        self.send_command(0x24)
-        self.send_data2(imageblack)
-        
-        self.send_command(0x26)
-        self.send_data2(imagered)
-        
+        self.bytes_sent = 0
+        # reset to the full window, a partial upload may have left a smaller one
+        window = self.windows_sequence(0, 0, self.width - 1, self.height - 1)
+        for command, image in ((0x24, imageblack), (0x26, imagered)):
+            if self.plane_unchanged(command, image):
+                continue
+            self.send_sequence(window + self.cursor_sequence(0, 0) + ((command, image),))
+            self.ram[command] = bytes(image)
+            self.bytes_sent += len(image)
+
+        self.ondisplay()
+
+    # display image, only writing the given regions to RAM
+    # regions are (x start byte, y start, x end byte, y end), inclusive
+    def display_regions(self, imageblack, imagered, regions):
+        self.bytes_sent = 0
+        for command, image in ((0x24, imageblack), (0x26, imagered)):
+            if self.plane_unchanged(command, image):
+                continue
+            for xstart, ystart, xend, yend in regions:
+                window = self.windows_sequence(xstart << 3, ystart, xend << 3, yend)
+                data = b"".join(bytes(image[y * self.linewidth + xstart:y * self.linewidth + xend + 1]) for y in range(ystart, yend + 1))
+                self.send_sequence(window + self.cursor_sequence(xstart, ystart) + ((command, data),))
+                self.bytes_sent += len(data)
+            self.ram[command] = bytes(image)
+        self.send_sequence(self.windows_sequence(0, 0, self.width - 1, self.height - 1))
+
         self.ondisplay()
         
     # display white image
@@ -178,26 +238,40 @@ class EPD:
         else:
             linewidth = int(self.width/8) + 1
             
-        buf = [0xff] * (int(linewidth * self.height))
-            
-        self.send_command(0x24)
-        self.send_data2(buf)
-        
-        self.send_command(0x26)
-        self.send_data2(buf)
+        buf = bytes([0xff] * (int(linewidth * self.height)))
+
+        self.send_sequence(self.windows_sequence(0, 0, self.width - 1, self.height - 1) + self.cursor_sequence(0, 0) + ((0x24, buf),))
+        self.send_sequence(self.cursor_sequence(0, 0) + ((0x26, buf),))
+        self.ram = {0x24: buf, 0x26: buf}
+        self.bytes_sent = len(buf) * 2
         
-        self.ondisplay()
+        self.ondisplay("clear")
 
     # Compatible with older version functions
     def Clear(self):
         self.clear()
 
-    # sleep
-    def sleep(self):
+    # deep sleep mode 1, RAM contents are kept until power is cut
+    def deep_sleep(self):
         self.send_command(0x10) # DEEP_SLEEP
         self.send_data(0x01) # check code
-        
-        epdconfig.delay_ms(2000)
+
+        # BUSY goes high once the controller is asleep
+        elapsed = epdconfig.wait_busy_assert(self.busy_pin, SLEEP_TIMEOUT_MS)
+        if elapsed is None:
+            logger.warning("e-Paper did not signal deep sleep within %d ms" % SLEEP_TIMEOUT_MS)
+        else:
+            self.busy_times["sleep"] = elapsed
+
+    # cut power to the panel and close SPI
+    def power_off(self):
         epdconfig.module_exit()
+        # power is cut, so RAM contents are lost
+        self.ram = {0x24: None, 0x26: None}
+
+    # sleep
+    def sleep(self):
+        self.deep_sleep()
+        self.power_off()
 ### END OF FILE ###
 
@@ -31,13 +31,34 @@ import os
 import logging
 import sys
 import time
-import subprocess
 
 from ctypes import *
 
 logger = logging.getLogger(__name__)
 
 
+def poll_busy_release(digital_read, delay_ms, now, pin, timeout_ms, interval_ms=10):
+    # fallback for backends without edge detection, returns ms waited or None on timeout
+    start = now()
+    while digital_read(pin) != 0:
+        if now() - start >= timeout_ms:
+            return None
+        delay_ms(interval_ms)
+    return now() - start
+
+def poll_busy_assert(digital_read, delay_ms, now, pin, timeout_ms, interval_ms=1):
+    # wait for BUSY to go high, returns ms waited or None on timeout
+    start = now()
+    while digital_read(pin) != 1:
+        if now() - start >= timeout_ms:
+            return None
+        delay_ms(interval_ms)
+    return now() - start
+
+def monotonic_ms():
+    return time.monotonic() * 1000.0
+
+
 class RaspberryPi:
     # Pin definition
     RST_PIN  = 17
@@ -98,6 +119,19 @@ class RaspberryPi:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_busy_release(self, pin, timeout_ms):
+        # edge triggered, gpiozero wakes us when BUSY falls instead of polling
+        start = monotonic_ms()
+        if not self.GPIO_BUSY_PIN.wait_for_release(timeout_ms / 1000.0):
+            return None
+        return monotonic_ms() - start
+
+    def wait_busy_assert(self, pin, timeout_ms):
+        start = monotonic_ms()
+        if not self.GPIO_BUSY_PIN.wait_for_press(timeout_ms / 1000.0):
+            return None
+        return monotonic_ms() - start
+
     def spi_writebyte(self, data):
         self.SPI.writebytes(data)
 
@@ -173,6 +207,9 @@ class JetsonNano:
     BUSY_PIN = 24
     PWR_PIN  = 18
 
+    # void SYSFS_software_spi_transfer_bulk(uint8_t *data, uint32_t len)
+    BULK_TRANSFER_SYMBOL = 'SYSFS_software_spi_transfer_bulk'
+
     def __init__(self):
         import ctypes
         find_dirs = [
@@ -189,6 +226,14 @@ class JetsonNano:
         if self.SPI is None:
             raise RuntimeError('Cannot find sysfs_software_spi.so')
 
+        # byte at a time transfer, and a whole buffer transfer if the library has one
+        self.spi_transfer = self.SPI.SYSFS_software_spi_transfer
+        self.spi_transfer_bulk = getattr(self.SPI, self.BULK_TRANSFER_SYMBOL, None)
+        if self.spi_transfer_bulk is None:
+            logger.debug("%s not found, falling back to per byte transfers" % self.BULK_TRANSFER_SYMBOL)
+        else:
+            self.spi_transfer_bulk.argtypes = [ctypes.POINTER(ctypes.c_uint8), ctypes.c_uint32]
+
         import Jetson.GPIO
         self.GPIO = Jetson.GPIO
 
@@ -201,12 +246,32 @@ class JetsonNano:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_busy_release(self, pin, timeout_ms):
+        return poll_busy_release(self.digital_read, self.delay_ms, monotonic_ms, pin, timeout_ms)
+
+    def wait_busy_assert(self, pin, timeout_ms):
+        return poll_busy_assert(self.digital_read, self.delay_ms, monotonic_ms, pin, timeout_ms)
+
     def spi_writebyte(self, data):
         self.SPI.SYSFS_software_spi_transfer(data[0])
 
     def spi_writebyte2(self, data):
-        for i in range(len(data)):
-            self.SPI.SYSFS_software_spi_transfer(data[i])
+        if self.spi_transfer_bulk is not None:
+            if isinstance(data, bytes):
+                # zero-copy pointer into the immutable buffer from EPD.getbuffer, alive as long as data is
+                buf = cast(c_char_p(data), POINTER(c_uint8))
+            elif isinstance(data, bytearray):
+                # zero-copy view of a writable buffer
+                buf = (c_uint8 * len(data)).from_buffer(data)
+            else:
+                buf = (c_uint8 * len(data)).from_buffer_copy(bytes(data))
+            self.spi_transfer_bulk(buf, len(data))
+            return
+
+        # no bulk symbol, still one call per byte but without the attribute lookups
+        transfer = self.spi_transfer
+        for byte in data:
+            transfer(byte)
 
     def module_init(self):
         self.GPIO.setmode(self.GPIO.BCM)
@@ -259,6 +324,12 @@ class SunriseX3:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_busy_release(self, pin, timeout_ms):
+        return poll_busy_release(self.digital_read, self.delay_ms, monotonic_ms, pin, timeout_ms)
+
+    def wait_busy_assert(self, pin, timeout_ms):
+        return poll_busy_assert(self.digital_read, self.delay_ms, monotonic_ms, pin, timeout_ms)
+
     def spi_writebyte(self, data):
         self.SPI.writebytes(data)
 
@@ -301,22 +372,229 @@ class SunriseX3:
         self.GPIO.cleanup([self.RST_PIN, self.DC_PIN, self.CS_PIN, self.BUSY_PIN], self.PWR_PIN)
 
 
-if sys.version_info[0] == 2:
-    process = subprocess.Popen("cat /proc/cpuinfo | grep Raspberry", shell=True, stdout=subprocess.PIPE)
-else:
-    process = subprocess.Popen("cat /proc/cpuinfo | grep Raspberry", shell=True, stdout=subprocess.PIPE, text=True)
-output, _ = process.communicate()
-if sys.version_info[0] == 2:
-    output = output.decode(sys.stdout.encoding)
+class Simulated:
+    # Pin definition
+    RST_PIN  = 17
+    DC_PIN   = 25
+    CS_PIN   = 8
+    BUSY_PIN = 24
+    PWR_PIN  = 18
+
+    # Controller RAM, 122 pixels per row padded to 16 bytes, 250 rows
+    RAM_WIDTH  = 16
+    RAM_HEIGHT = 250
+
+    def __init__(self, fast=None, reset_ms=None, swreset_ms=None, refresh_ms=None):
+        # fast mode advances a virtual clock instead of sleeping
+        if fast is None:
+            fast = os.environ.get("EPD_SIM_FAST", "1") == "1"
+        self.fast = fast
+        # how long BUSY stays high after each operation
+        self.busy_times = {
+            "reset": reset_ms if reset_ms is not None else int(os.environ.get("EPD_SIM_RESET_MS", 20)),
+            0x12: swreset_ms if swreset_ms is not None else int(os.environ.get("EPD_SIM_SWRESET_MS", 20)),
+            0x20: refresh_ms if refresh_ms is not None else int(os.environ.get("EPD_SIM_REFRESH_MS", 15000)),
+        }
+        self.clock = 0.0
+        self.pins = {self.RST_PIN: 0, self.DC_PIN: 0, self.CS_PIN: 1, self.PWR_PIN: 0}
+        self.ram = {
+            0x24: bytearray([0xff] * (self.RAM_WIDTH * self.RAM_HEIGHT)),
+            0x26: bytearray([0xff] * (self.RAM_WIDTH * self.RAM_HEIGHT)),
+        }
+        self.clear_log()
+        self._reset_controller()
+
+    def clear_log(self):
+        # every ("command", byte), ("data", bytes) and ("busy", ms) seen, in order
+        self.events = []
+        self.gpio_writes = 0
+        self.gpio_reads = 0
+        self.spi_calls = 0
+        self.spi_bytes = 0
+        self.refreshes = 0
+
+    def _reset_controller(self):
+        self.command = None
+        self.entry_mode = 0x03
+        self.x_window = (0, self.RAM_WIDTH - 1)
+        self.y_window = (0, self.RAM_HEIGHT - 1)
+        self.x_counter = 0
+        self.y_counter = 0
+        self.params = []
+        self.busy_until = 0.0
+        self.busy_since = None
+        self.deep_sleep = False
+
+    def _now(self):
+        if self.fast:
+            return self.clock
+        return time.monotonic() * 1000.0
+
+    def _set_busy(self, duration):
+        self.busy_until = max(self.busy_until, self._now() + duration)
+
+    def digital_write(self, pin, value):
+        self.gpio_writes += 1
+        if pin == self.RST_PIN and self.pins[pin] == 0 and value:
+            # rising edge after a low pulse is a hardware reset
+            self._reset_controller()
+            self._set_busy(self.busy_times["reset"])
+        self.pins[pin] = 1 if value else 0
+
+    def digital_read(self, pin):
+        self.gpio_reads += 1
+        if pin != self.BUSY_PIN:
+            return self.pins.get(pin, 0)
+        if self.deep_sleep or self._now() < self.busy_until:
+            if self.busy_since is None:
+                self.busy_since = self._now()
+            return 1
+        if self.busy_since is not None:
+            self.events.append(("busy", self._now() - self.busy_since))
+            self.busy_since = None
+        return 0
+
+    def delay_ms(self, delaytime):
+        if self.fast:
+            self.clock += delaytime
+        else:
+            time.sleep(delaytime / 1000.0)
+
+    def wait_busy_release(self, pin, timeout_ms):
+        return poll_busy_release(self.digital_read, self.delay_ms, self._now, pin, timeout_ms)
+
+    def wait_busy_assert(self, pin, timeout_ms):
+        return poll_busy_assert(self.digital_read, self.delay_ms, self._now, pin, timeout_ms)
+
+    def spi_writebyte(self, data):
+        self.spi_writebyte2(data)
+
+    def spi_writebyte2(self, data):
+        self.spi_calls += 1
+        self.spi_bytes += len(data)
+        if self.pins[self.DC_PIN] == 0:
+            for command in data:
+                self._command(command)
+        else:
+            self.events.append(("data", bytes(data)))
+            self._data(data)
+
+    def _command(self, command):
+        self.events.append(("command", command))
+        self.command = command
+        self.params = []
+        if command == 0x12: # SWRESET
+            self._set_busy(self.busy_times[0x12])
+        elif command == 0x20: # Activate display update
+            self.refreshes += 1
+            self._set_busy(self.busy_times[0x20])
+        elif command == 0x10: # Deep sleep, BUSY stays high until reset
+            self.deep_sleep = True
+
+    def _data(self, data):
+        if self.command in self.ram:
+            self._write_ram(self.ram[self.command], data)
+            return
+        self.params.extend(data)
+        if self.command == 0x11 and len(self.params) >= 1:
+            if self.params[0] != 0x03:
+                logger.warning("Simulated EPD only models data entry mode 0x03")
+            self.entry_mode = self.params[0]
+        elif self.command == 0x44 and len(self.params) >= 2:
+            self.x_window = (self.params[0], self.params[1])
+        elif self.command == 0x45 and len(self.params) >= 4:
+            self.y_window = (self.params[0] | self.params[1] << 8, self.params[2] | self.params[3] << 8)
+        elif self.command == 0x4E and len(self.params) >= 1:
+            self.x_counter = self.params[0]
+        elif self.command == 0x4F and len(self.params) >= 2:
+            self.y_counter = self.params[0] | self.params[1] << 8
+
+    def _write_ram(self, ram, data):
+        # data entry mode 0x03, X increments first then wraps to the next Y
+        for byte in data:
+            if self.x_counter < self.RAM_WIDTH and self.y_counter < self.RAM_HEIGHT:
+                ram[self.y_counter * self.RAM_WIDTH + self.x_counter] = byte
+            self.x_counter += 1
+            if self.x_counter > self.x_window[1]:
+                self.x_counter = self.x_window[0]
+                self.y_counter += 1
+                if self.y_counter > self.y_window[1]:
+                    self.y_counter = self.y_window[0]
+
+    def get_images(self, width=122):
+        # decode the black (0x24) and red (0x26) RAM back into images
+        from PIL import Image
+        size = (self.RAM_WIDTH * 8, self.RAM_HEIGHT)
+        black = Image.frombytes('1', size, bytes(self.ram[0x24])).crop((0, 0, width, self.RAM_HEIGHT))
+        red = Image.frombytes('1', size, bytes(self.ram[0x26])).crop((0, 0, width, self.RAM_HEIGHT))
+        return black, red
+
+    def module_init(self, cleanup=False):
+        self.digital_write(self.PWR_PIN, 1)
+        return 0
+
+    def module_exit(self, cleanup=False):
+        logger.debug("spi end")
+        self.digital_write(self.RST_PIN, 0)
+        self.digital_write(self.DC_PIN, 0)
+        self.digital_write(self.PWR_PIN, 0)
+        logger.debug("close 5V, Module enters 0 power consumption ...")
 
-if "Raspberry" in output:
-    implementation = RaspberryPi()
-elif os.path.exists('/sys/bus/platform/drivers/gpio-x3'):
-    implementation = SunriseX3()
-else:
-    implementation = JetsonNano()
 
-for func in [x for x in dir(implementation) if not x.startswith('_')]:
-    setattr(sys.modules[__name__], func, getattr(implementation, func))
+# Pin definition, shared by every backend so it can be read without touching hardware
+RST_PIN  = 17
+DC_PIN   = 25
+CS_PIN   = 8
+BUSY_PIN = 24
+PWR_PIN  = 18
+
+BACKENDS = {
+    "raspberrypi": RaspberryPi,
+    "sunrisex3": SunriseX3,
+    "jetsonnano": JetsonNano,
+    "simulated": Simulated,
+}
+
+# Backend is created on the first hardware call, see __getattr__
+implementation = None
+
+def detect_backend():
+    backend = os.environ.get("EPD_BACKEND", "").lower()
+    if backend:
+        if backend not in BACKENDS:
+            raise ValueError("Unknown EPD_BACKEND '%s', expected one of %s" % (backend, ", ".join(BACKENDS)))
+        return backend
+
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            if "Raspberry" in f.read():
+                return "raspberrypi"
+    except OSError:
+        pass
+    if os.path.exists('/sys/bus/platform/drivers/gpio-x3'):
+        return "sunrisex3"
+    return "jetsonnano"
+
+def get_implementation():
+    global implementation
+    if implementation is None:
+        backend = detect_backend()
+        logger.debug("Using %s backend" % backend)
+        implementation = BACKENDS[backend]()
+        # bind the backend's functions and pin numbers to the module so later calls skip __getattr__,
+        # anything else (e.g. the simulator's logs and RAM) changes and is served live by __getattr__
+        for name in [x for x in dir(implementation) if not x.startswith('_')]:
+            value = getattr(implementation, name)
+            if callable(value) or (name.endswith('_PIN') and isinstance(value, int)):
+                setattr(sys.modules[__name__], name, value)
+    return implementation
+
+def __getattr__(name):
+    if name.startswith('_'):
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    try:
+        return getattr(get_implementation(), name)
+    except AttributeError:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name)) from None
 
 ### END OF FILE ###
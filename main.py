@@ -1,11 +1,15 @@
 import os
 import sys
 from dotenv import load_dotenv
-import requests
 import logging
 
 from reading.Reading import Reading
+from reading.ReadingBatch import ReadingBatch
 from display.Display import Display
+from daemon.Daemon import Daemon
+from fetch.Fetcher import Fetcher
+from history.History import History
+from state.InstanceLock import InstanceLock
 
 logging.basicConfig(
     format='%(asctime)s %(levelname)-8s %(message)s',
@@ -14,26 +18,81 @@ logging.basicConfig(
     )
 logger = logging.getLogger(__name__)
 
+def run(fetcher, mode):
+    """Fetch the latest reading and draw it once
+
+    Args
+    -----
+    fetcher: `Fetcher`
+        Fetcher for the API and its cache
+    mode: `str`
+        `dev` to only draw an image, `clear` to clear and redraw, None for a normal update
+    """
+    # Dev and clear always need a reading to draw, so only revalidate on normal runs
+    result = fetcher.wait_for_refresh(mode is None)
+    data, version = fetcher.cache.get_entry()
+    if data is None:
+        logger.error("No reading available from the API or cache")
+        return
+
+    stale = fetcher.cache.is_stale()
+    # Nothing new from the API and the cached reading is already on the display
+    if mode is None and result == "not_modified" and fetcher.cache.is_displayed(stale):
+        return
+
+    reading = Reading(data)
+    history = History()
+    reading.get_changes_and_save(history, ReadingBatch(data))
+    display = Display(history = history)
+    display.set_reading(reading, stale)
+
+    try:
+        # If dev arg passed, skip everything else and just draw_reading in dev mode
+        if mode == "dev":
+            display.draw_reading(True)
+        # If clear arg passed, clear and redraw the display even if the reading hasn't changed
+        elif mode == "clear":
+            display.update(True)
+            display.cleanup()
+            fetcher.cache.mark_displayed(stale, version)
+        else:
+            # Redraw even if the reading hasn't changed as staleness may have, unchanged frames are skipped by update
+            display.update()
+            display.cleanup()
+            fetcher.cache.mark_displayed(stale, version)
+
+    except IOError as e:
+        logger.error(e)
+    finally:
+        history.close()
+
 load_dotenv()
 API_URL = os.environ.get("WEATHERVANE_API_URL")
+mode = sys.argv[1] if len(sys.argv) > 1 else None
+
+# Only one instance may drive the panel and write state, overlapping runs leave their request for it and exit.
+# A daemon waits its turn instead, handing over would leave it never started
+lock = InstanceLock()
+if not lock.acquire(mode == "daemon"):
+    if mode != "dev":
+        lock.hand_over(mode or "update")
+        lock.notify()
+    sys.exit()
 
-r = requests.get(url= API_URL)
-data = r.json()
-reading = Reading(data)
-is_new_reading = reading.get_changes_and_save()
-display = Display(reading)
-
-try:
-    # If dev arg passed, skip everything else and just draw_reading in dev mode
-    if len(sys.argv) > 1 and sys.argv[1] == "dev":
-        display.draw_reading(True)
-    elif is_new_reading:
-        display.init_display()
-        display.draw_reading(False)
-        display.sleep(False)
-        display.cleanup()
-    
+# If daemon arg passed, keep running and update on an interval instead of once
+if mode == "daemon":
+    Daemon(API_URL, int(os.environ.get("DAEMON_INTERVAL", 300)), lock).run()
     sys.exit()
 
-except IOError as e:
-    logger.error(e)
\ No newline at end of file
+fetcher = Fetcher(API_URL, Reading)
+run(fetcher, mode)
+# Serve any runs that overlapped this one with one more pass each time, clearing if any of them asked to
+while True:
+    requests = lock.take_requests()
+    while requests:
+        run(fetcher, "clear" if "clear" in requests else None)
+        requests = lock.take_requests()
+    lock.release()
+    # A run that found the lock held may have handed over after the last check, serve it unless another instance took over
+    if not lock.has_requests() or not lock.acquire():
+        break
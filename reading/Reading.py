@@ -1,7 +1,8 @@
-import json
 import logging
 from datetime import datetime
 import pytz
+from history.History import FIELDS
+from reading.ReadingBatch import COMPASS_DIRS
 
 logger = logging.getLogger(__name__)
 
@@ -10,6 +11,7 @@ class Reading:
     def __init__(self, data):
         timestamp_obj = datetime.strptime(data[0]["timestamp"], "%Y-%m-%dT%H:%M:%SZ")
         aware_ts_obj = pytz.timezone("UTC").localize(timestamp_obj)
+        self.timestamp = int(aware_ts_obj.timestamp())
         self.time_str = aware_ts_obj.astimezone(pytz.timezone("Europe/London")).strftime('%d/%m/%y %H:%M')
         self.temperature = data[0]["readings"]["temperature"]
         self.pressure = data[0]["readings"]["pressure"]
@@ -17,18 +19,8 @@ class Reading:
         self.luminance = data[0]["readings"]["luminance"]
         self.rain = data[0]["readings"]["rain"]
         self.wind_speed = round(float(data[0]["readings"]["wind_speed"]), 2)
-        compass_dirs = {
-            0: "South",
-            45: "Southwest",
-            90: "West",
-            135: "Northwest",
-            180: "North",
-            225: "Northeast",
-            270: "East",
-            315: "Southeast",
-            360: "South",
-        }
-        self.wind_direction = compass_dirs[data[0]["readings"]["wind_direction"]]
+        self.wind_degrees = data[0]["readings"]["wind_direction"]
+        self.wind_direction = COMPASS_DIRS[self.wind_degrees]
         self.changes = { # These should always be either "inc", "dec", or "same"
             "temperature": "same",
             "pressure": "same",
@@ -38,41 +30,52 @@ class Reading:
             "wind_speed": "same"
         }
 
-    def get_changes_and_save(self):
-        """Compare current reading to previous
-        Update self.changes with increases and decreases
-        Save reading to last_reading.json or create if doesn't exist
+    def get_changes_and_save(self, history, batch):
+        """Save any readings in the response that aren't in history yet,
+        then update self.changes with increases and decreases since the reading before this one
+
+        Args
+        -----
+        history: `History`
+            Reading history to compare against and save to
+        batch: `ReadingBatch`
+            Every reading in the API response
+
+        Returns
+        -----
+        `bool`
+            True if any readings were new
         """
+        added = batch.save(history)
+        if not added:
+            logger.warning("Reading has not updated, possibly a missed upload?")
 
-        with open("last_reading.json", "r") as f_read:
-            last_reading = json.load(f_read)
-            self.changes = last_reading["changes"] # populate changes from file for consistency
-            if last_reading["reading"]["time_str"] != self.time_str: # if no new reading, don't change anything
-                for r in last_reading["reading"]:
-                    if r != "time_str":
-                        if getattr(self, r) > last_reading["reading"][r]:
-                            self.changes[r] = "inc"
-                        elif getattr(self, r) < last_reading["reading"][r]:
-                            self.changes[r] = "dec"
-                        else:
-                            self.changes[r] = "same"
-                with open("last_reading.json", "w") as f_write:
-                    new_reading = {
-                        "reading": {
-                        "time_str": self.time_str,
-                        "temperature": self.temperature,
-                        "pressure": self.pressure,
-                        "humidity": self.humidity,
-                        "luminance": self.luminance,
-                        "rain": self.rain,
-                        "wind_speed": self.wind_speed
-                        },
-                        "changes": self.changes
-                    }
-                    json.dump(new_reading, f_write, ensure_ascii = False, indent = 4)
-                return True
-            else:
-                logging.warn("Reading has not updated, possibly a missed upload?")
-                return False
+        last = history.last()
+        if last is not None and last[0] == self.timestamp and history.count > 1:
+            self.changes = self.compare(history.read(-2), last)
+        return added > 0
 
-        
+    def compare(self, previous, current):
+        """Returns whether each value increased, decreased or stayed the same between two records
+
+        Args
+        -----
+        previous: `tuple`
+            Older history record
+        current: `tuple`
+            Newer history record
+
+        Returns
+        -----
+        `dict`
+            `inc`, `dec` or `same` for each value
+        """
+        changes = {}
+        for i, field in enumerate(FIELDS, start = 1):
+            if current[i] > previous[i]:
+                changes[field] = "inc"
+            elif current[i] < previous[i]:
+                changes[field] = "dec"
+            else:
+                changes[field] = "same"
+        return changes
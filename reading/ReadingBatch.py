@@ -0,0 +1,109 @@
+import logging
+from array import array
+from bisect import bisect_right
+from datetime import datetime, timezone
+from history.History import FIELDS
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# wind direction in degrees from the API to compass direction
+COMPASS_DIRS = {
+    0: "South",
+    45: "Southwest",
+    90: "West",
+    135: "Northwest",
+    180: "North",
+    225: "Northeast",
+    270: "East",
+    315: "Southeast",
+    360: "South",
+}
+
+def parse_timestamp(text):
+    """Returns an API timestamp as a Unix timestamp
+
+    Args
+    -----
+    text: `str`
+        UTC timestamp in `TIMESTAMP_FORMAT`
+
+    Returns
+    -----
+    `int`
+        Unix timestamp
+    """
+    return int(datetime.strptime(text, TIMESTAMP_FORMAT).replace(tzinfo = timezone.utc).timestamp())
+
+class ReadingBatch:
+    """Every reading in an API response, as columns sorted by timestamp
+
+    Readings that can't be parsed are skipped, and of readings sharing a timestamp the first is kept
+    """
+    def __init__(self, data):
+        rows = {}
+        for item in data:
+            try:
+                values = item["readings"]
+                if values["wind_direction"] not in COMPASS_DIRS:
+                    raise ValueError("unknown wind direction")
+                row = (
+                    parse_timestamp(item["timestamp"]),
+                    *(float(values[field]) for field in FIELDS[:-1]),
+                    # match the rounding of `Reading.wind_speed`
+                    round(float(values["wind_speed"]), 2),
+                    int(values["wind_direction"]),
+                )
+            except (KeyError, TypeError, ValueError):
+                logger.warning(f"Skipping malformed reading {item!r}")
+                continue
+            rows.setdefault(row[0], row)
+
+        self.timestamps = array("q")
+        self.values = {field: array("d") for field in FIELDS}
+        self.wind_degrees = array("H")
+        for row in sorted(rows.values()):
+            self.timestamps.append(row[0])
+            for field, value in zip(FIELDS, row[1:]):
+                self.values[field].append(value)
+            self.wind_degrees.append(row[-1])
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def get_records(self, after = None):
+        """Returns the readings as history records
+
+        Args
+        -----
+        after: `int`
+            Only return readings newer than this Unix timestamp
+
+        Returns
+        -----
+        `list(tuple)`
+            records oldest first
+        """
+        first = 0 if after is None else bisect_right(self.timestamps, after)
+        columns = (self.timestamps, *(self.values[field] for field in FIELDS), self.wind_degrees)
+        return list(zip(*(column[first:] for column in columns)))
+
+    def save(self, history):
+        """Add readings newer than the newest in history in a single write,
+        filling in any missed since the last run
+
+        Args
+        -----
+        history: `History`
+            Reading history to save to
+
+        Returns
+        -----
+        `int`
+            Number of readings added
+        """
+        last = history.last()
+        added = history.extend(self.get_records(None if last is None else last[0]))
+        if added > 1:
+            logger.info(f"Backfilled {added} readings")
+        return added
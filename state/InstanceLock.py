@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import fcntl
+import signal
+import logging
+from state.State import state_path
+
+logger = logging.getLogger(__name__)
+
+class InstanceLock:
+    """Exclusive lock held by the running instance, so only one process drives the panel and writes state
+
+    Runs that find it held leave a request in a drop file for the holder to pick up instead.
+    The lock is released by the OS when the holder exits, even if it crashes
+    """
+    def __init__(self, filename = "weathervane.lock", requests_filename = "handoff.jsonl"):
+        self.path = state_path(filename)
+        self.requests_path = state_path(requests_filename)
+        self.file = None
+
+    def acquire(self, wait = False):
+        """Take the lock
+
+        Args
+        -----
+        wait: `bool`
+            If true, wait for the instance holding the lock to release it instead of giving up
+
+        Returns
+        -----
+        `bool`
+            True if the lock was taken, False if another instance holds it
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok = True)
+        lock_file = open(self.path, "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            pid, role = self.get_holder()
+            logger.warning(f"Another instance is already running (pid {pid or 'unknown'}, {role or 'one-off run'})")
+            if not wait:
+                lock_file.close()
+                return False
+            logger.info("Waiting for it to finish")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        lock_file.truncate(0)
+        lock_file.write(f"{os.getpid()}\n")
+        lock_file.flush()
+        self.file = lock_file
+        return True
+
+    def set_role(self, role):
+        """Record what the holder is in the lock file, so overlapping runs know whether to signal it
+
+        Args
+        -----
+        role: `str`
+            `daemon` once it's ready for `SIGUSR2`
+        """
+        self.file.truncate(0)
+        self.file.write(f"{os.getpid()} {role}\n")
+        self.file.flush()
+
+    def get_holder(self):
+        """Returns the pid and role of the instance holding the lock
+
+        Returns
+        -----
+        `tuple`
+            pid and role, None for either that isn't recorded
+        """
+        try:
+            with open(self.path, "r") as f_read:
+                fields = f_read.read().split()
+            return int(fields[0]), fields[1] if len(fields) > 1 else None
+        except (OSError, ValueError, IndexError):
+            return None, None
+
+    def notify(self):
+        """Wake a daemon holding the lock with `SIGUSR2` so it serves handed over requests straight away
+
+        One-off runs aren't signalled, they pick up requests when they finish
+        """
+        pid, role = self.get_holder()
+        if pid is None or role != "daemon":
+            return
+        try:
+            os.kill(pid, signal.SIGUSR2)
+        except (ProcessLookupError, PermissionError) as e:
+            logger.warning(f"Couldn't wake the running instance (pid {pid}): {e}")
+
+    def has_requests(self):
+        """Check whether any requests are waiting to be taken"""
+        return os.path.exists(self.requests_path)
+
+    def hand_over(self, request):
+        """Leave a request for the instance holding the lock
+
+        Each request is a single appended line, so overlapping runs can't garble each other's
+
+        Args
+        -----
+        request: `str`
+            What this run was asked to do, e.g. `update` or `clear`
+        """
+        line = json.dumps({"pid": os.getpid(), "request": request, "at": time.time()}) + "\n"
+        fd = os.open(self.requests_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+        logger.info(f"Handed {request} request over to the running instance")
+
+    def take_requests(self):
+        """Returns and removes requests left by runs that overlapped this one
+
+        Returns
+        -----
+        `list(str)`
+            requests oldest first
+        """
+        taking = f"{self.requests_path}.taking"
+        try:
+            os.replace(self.requests_path, taking)
+        except FileNotFoundError:
+            return []
+        with open(taking, "r") as f_read:
+            lines = f_read.readlines()
+        os.remove(taking)
+
+        requests = []
+        for line in lines:
+            try:
+                requests.append(json.loads(line)["request"])
+            except (ValueError, KeyError, TypeError):
+                logger.warning(f"Ignoring malformed handed over request {line!r}")
+        if requests:
+            logger.info(f"{len(requests)} overlapping runs handed over requests: {', '.join(requests)}")
+        return requests
+
+    def release(self):
+        """Release the lock if held"""
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
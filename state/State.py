@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import logging
+import threading
+import weakref
+
+logger = logging.getLogger(__name__)
+
+def state_path(filename):
+    """Return the path of a file in the state directory
+
+    Args
+    -----
+    filename: `str`
+        Name of file in the state directory, `STATE_DIR` or the working directory if unset
+
+    Returns
+    -----
+    `str`
+        path to file
+    """
+    return os.path.join(os.environ.get("STATE_DIR", "."), filename)
+
+def write_atomic(path, data):
+    """Replace a file's contents so a power cut leaves either the old or the new file, never a mix
+
+    Writes to a temporary file alongside, syncs it and renames it over the original
+
+    Args
+    -----
+    path: `str`
+        Path to file
+    data: `bytes`
+        New contents
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok = True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f_write:
+        f_write.write(data)
+        f_write.flush()
+        os.fsync(f_write.fileno())
+    os.replace(tmp_path, path)
+    # sync the directory too so the rename itself survives
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+def set_aside(path):
+    """Move an unreadable file out of the way, keeping it for inspection
+
+    Args
+    -----
+    path: `str`
+        Path to file
+    """
+    logger.warning(f"{path} is corrupt, moving it to {path}.corrupt and starting afresh")
+    os.replace(path, f"{path}.corrupt")
+
+class State:
+    """Small key/value store persisted between runs
+
+    Writes are atomic and skipped if nothing has changed. When `flush_interval` is set,
+    as in daemon mode, saves are coalesced into at most one write per interval
+    """
+    # seconds between writes of each file, 0 writes on every save
+    flush_interval = 0
+    instances = weakref.WeakSet()
+
+    def __init__(self, filename):
+        self.path = state_path(filename)
+        self.data = {}
+        self.dirty = False
+        self.written_at = None
+        self.lock = threading.Lock()
+        self.load()
+        self.instances.add(self)
+
+    def load(self):
+        """Read stored values from file, starting empty if it's missing or corrupt"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f_read:
+                data = json.load(f_read)
+            if not isinstance(data, dict):
+                raise ValueError("not a JSON object")
+        except (OSError, ValueError):
+            set_aside(self.path)
+            return
+        self.data = data
+
+    def get(self, key, default = None):
+        """Return a stored value
+
+        Args
+        -----
+        key: `str`
+            Key of value to return
+        default: `any`
+            Returned if key has not been stored
+
+        Returns
+        -----
+        `any`
+            Stored value or default
+        """
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        """Store a value, written to file on next `save`
+
+        Args
+        -----
+        key: `str`
+            Key to store value under
+        value: `any`
+            JSON serialisable value
+        """
+        # under the lock so a write in progress on another thread can't clear the dirty flag of this change
+        with self.lock:
+            if self.data.get(key) != value or key not in self.data:
+                self.data[key] = value
+                self.dirty = True
+
+    def save(self):
+        """Write stored values to file, unless it was written less than `flush_interval` seconds ago"""
+        self.flush(False)
+
+    def flush(self, force = True):
+        """Write stored values to file if any have changed
+
+        Args
+        -----
+        force: `bool`
+            Write even if it was written less than `flush_interval` seconds ago
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+            if not force and self.written_at is not None and time.monotonic() - self.written_at < self.flush_interval:
+                return
+            write_atomic(self.path, json.dumps(dict(self.data), ensure_ascii = False, separators = (",", ":")).encode())
+            self.dirty = False
+            self.written_at = time.monotonic()
+
+    @classmethod
+    def flush_all(cls, force = True):
+        """Write every state with unsaved changes, including reading history
+
+        Args
+        -----
+        force: `bool`
+            Write even those written less than `flush_interval` seconds ago
+        """
+        for state in list(cls.instances):
+            state.flush(force)
@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from fetch.Fetcher import Fetcher
+
+PAYLOAD = [{"timestamp": 1700000000, "temperature": 12.5}]
+ETAG = '"reading-1"'
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves the responses queued on the server, recording the headers of each request"""
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        status, delay = self.server.responses.pop(0) if self.server.responses else (200, 0)
+        time.sleep(delay)
+        if status == 200 and self.headers.get("If-None-Match") == ETAG:
+            status = 304
+        try:
+            self.send_response(status)
+            if status == 200:
+                body = json.dumps(PAYLOAD).encode()
+                self.send_header("ETag", ETAG)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+        except ConnectionError:
+            # the client timed out and hung up
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+class TestFetcher(unittest.TestCase):
+    def setUp(self):
+        self.state_dir = tempfile.TemporaryDirectory()
+        self.environ = dict(os.environ)
+        os.environ.update({
+            "STATE_DIR": self.state_dir.name,
+            "API_RETRY_BACKOFF": "0",
+            "API_CONNECT_TIMEOUT": "1",
+            "API_READ_TIMEOUT": "1",
+        })
+        # port 0 picks a free port
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.server.responses = []
+        self.server.requests = []
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/readings"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.environ.clear()
+        os.environ.update(self.environ)
+        self.state_dir.cleanup()
+
+    def test_not_modified(self):
+        fetcher = Fetcher(self.url)
+        self.assertEqual(fetcher.refresh(), "new")
+        self.assertEqual(fetcher.cache.get_data(), PAYLOAD)
+        self.assertEqual(fetcher.cache.get_validators()["etag"], ETAG)
+
+        self.assertEqual(fetcher.refresh(), "not_modified")
+        self.assertEqual(self.server.requests[1].get("If-None-Match"), ETAG)
+        self.assertEqual(fetcher.cache.get_data(), PAYLOAD)
+
+    def test_unavailable_is_retried(self):
+        self.server.responses = [(503, 0), (200, 0)]
+        fetcher = Fetcher(self.url)
+        self.assertEqual(fetcher.refresh(), "new")
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(fetcher.cache.get_data(), PAYLOAD)
+
+    def test_read_timeout(self):
+        os.environ.update({"API_READ_TIMEOUT": "0.2", "API_RETRIES": "0"})
+        self.server.responses = [(200, 1)]
+        fetcher = Fetcher(self.url)
+        self.assertEqual(fetcher.refresh(), "failed")
+        self.assertIsNone(fetcher.cache.get_data())
+
+    def test_replaced_while_drawing(self):
+        fetcher = Fetcher(self.url)
+        self.assertEqual(fetcher.refresh(), "new")
+        data, version = fetcher.cache.get_entry()
+        # a slow refresh lands while the panel is still drawing the old response
+        fetcher.cache.put([{"timestamp": 1700000300, "temperature": 13.0}])
+        fetcher.cache.mark_displayed(False, version)
+        self.assertFalse(fetcher.cache.is_displayed(False))
+
+        data, version = fetcher.cache.get_entry()
+        fetcher.cache.mark_displayed(False, version)
+        self.assertTrue(fetcher.cache.is_displayed(False))
+
+if __name__ == "__main__":
+    unittest.main()